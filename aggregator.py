@@ -0,0 +1,344 @@
+import heapq
+import itertools
+import math
+import socketserver
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+from pymongo import MongoClient
+
+from detect import (
+    COLLECTION_NAME,
+    DB_NAME,
+    MONGO_URI,
+    check_interval,
+    open_rollup,
+    send_alert_email,
+)
+from sensor import SENSOR_CONFIG, decode_batch, max_event_delay, recv_frame
+
+# 애그리게이터 설정
+AGGREGATOR_CONFIG = {
+    "port": 7000,
+    # 센서별 스트림 병합 전 대기 시간 (초). None이면 SENSOR_CONFIG로 계산한 센서의
+    # 최대 전송 지연 + network_margin. 이보다 늦게 도착한 이벤트는 버린다.
+    "reorder_delay": None,
+    "network_margin": 0.5,  # 센서 -> 애그리게이터 네트워크 지연 여유 (초)
+    "report_interval": 10,  # 늦게 도착해 버린 이벤트 출력 주기 (초)
+    "merge_window": 0.015,  # 여러 센서가 받은 같은 광고 이벤트로 볼 시간 폭 (초)
+    "offset_samples": 20,  # 센서 시계 오프셋 추정에 쓰는 최근 배치 수
+    "far_apart_distance": 30.0,  # 동시에 같은 주소를 볼 수 없는 센서 간 거리 (m)
+    # 센서 ID -> (x, y) 좌표 (m), 예: {"floor1-east": (0, 0)}
+    # 비어 있으면 원거리 동시 관측 검사를 하지 않고, 먼 센서의 이벤트도 하나로 합친다.
+    "sensor_positions": {},
+}
+
+# 여러 센서가 같은 시각에 받은 광고 이벤트 묶음
+#   timestamp: 애그리게이터 시계 기준 시각 (가장 먼저 받은 센서 기준)
+#   sensors:   수신 센서 ID 튜플
+#   rssi:      센서별 최대 RSSI 튜플
+#   far_apart: 같은 시간 창에 이 주소를 받은 먼 센서 쌍 (센서 A, 센서 B, 거리) 튜플
+Sighting = namedtuple(
+    "Sighting",
+    ["address", "pdu_type", "timestamp", "sensors", "rssi", "payload", "far_apart"],
+)
+
+
+class ClockOffsets:
+    """
+    센서별 시계 오프셋 추정.
+    배치의 (수신 시각 - 센서 전송 시각) 중 최근 samples개의 최솟값을 오프셋으로 쓴다.
+    최솟값은 네트워크 지연이 가장 작았던 배치에 해당한다.
+    """
+
+    def __init__(self, samples=20):
+        self.samples = samples
+        self._samples = {}
+
+    def update(self, sensor_id, send_time, recv_time):
+        samples = self._samples.setdefault(sensor_id, deque(maxlen=self.samples))
+        samples.append(recv_time - send_time)
+        return min(samples)
+
+    def offset(self, sensor_id):
+        samples = self._samples.get(sensor_id)
+        return min(samples) if samples else 0.0
+
+
+class Aggregator:
+    """
+    센서들의 광고 이벤트 스트림을 병합하는 애그리게이터.
+
+    - 이벤트 시각을 센서 시계 오프셋으로 보정한 뒤 reorder_delay만큼 기다렸다가
+      시간 순으로 내보낸다. 그보다 늦게 도착한 이벤트는 버린다.
+    - 같은 주소의 이벤트를 서로 다른 센서가 merge_window 안에 받았으면
+      Sighting 하나로 합쳐 handle_sighting을 호출한다.
+    - 단, 서로 far_apart_distance보다 먼 센서의 이벤트는 합치지 않는다 (먼 곳의 복제
+      비콘이 짧은 간격을 숨기지 않도록). 이때 새 Sighting의 far_apart에 센서 쌍을 남긴다.
+    """
+
+    def __init__(
+        self,
+        handle_sighting,
+        reorder_delay=1.0,
+        merge_window=0.015,
+        offset_samples=20,
+        sensor_positions=None,
+        far_apart_distance=30.0,
+    ):
+        self.handle_sighting = handle_sighting
+        self.reorder_delay = reorder_delay
+        self.merge_window = merge_window
+        self.offsets = ClockOffsets(offset_samples)
+        self.sensor_positions = sensor_positions or {}
+        self.far_apart_distance = far_apart_distance
+
+        self.counts = {"batches": 0, "events": 0, "late": 0, "sightings": 0}
+        self._heap = []
+        self._seq = itertools.count()
+        self._watermark = float("-inf")
+        # 주소 -> [첫 시각, 센서 목록, RSSI 목록, 첫 이벤트, 원거리 센서 쌍] (시작 순)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add_batch(self, sensor_id, send_time, events, recv_time=None):
+        """센서에서 받은 배치를 추가"""
+        recv_time = time.time() if recv_time is None else recv_time
+        with self._lock:
+            offset = self.offsets.update(sensor_id, send_time, recv_time)
+            self.counts["batches"] += 1
+            for event in events:
+                timestamp = event.timestamp + offset
+                if timestamp < self._watermark:
+                    self.counts["late"] += 1
+                    continue
+                self.counts["events"] += 1
+                heapq.heappush(
+                    self._heap, (timestamp, next(self._seq), sensor_id, event)
+                )
+
+    def release(self, now=None):
+        """reorder_delay가 지난 이벤트를 시간 순으로 병합해 내보냄"""
+        now = time.time() if now is None else now
+        self._release(now - self.reorder_delay)
+
+    def flush(self):
+        """대기 중인 이벤트를 모두 내보냄"""
+        self._release(float("inf"))
+        sightings = list(self._pending.values())
+        self._pending.clear()
+        for entry in sightings:
+            self._emit(entry)
+
+    def _release(self, watermark):
+        with self._lock:
+            self._watermark = max(self._watermark, watermark)
+            ready = []
+            while self._heap and self._heap[0][0] <= watermark:
+                ready.append(heapq.heappop(self._heap))
+
+        for timestamp, _, sensor_id, event in ready:
+            self._merge(timestamp, sensor_id, event)
+
+        # 시간 창이 지난 묶음 방출
+        for address in [
+            address
+            for address, entry in self._pending.items()
+            if watermark - entry[0] > self.merge_window
+        ]:
+            self._emit(self._pending.pop(address))
+
+    def _merge(self, timestamp, sensor_id, event):
+        rssi = max((value for value in event.rssi if value is not None), default=None)
+        entry = self._pending.get(event.address)
+        far_apart = []
+        if entry is not None and timestamp - entry[0] <= self.merge_window:
+            far_apart = [
+                pair
+                for other in entry[1]
+                for pair in far_apart_sensors(
+                    (other, sensor_id), self.sensor_positions, self.far_apart_distance
+                )
+            ]
+        if entry is not None and (
+            timestamp - entry[0] > self.merge_window
+            or sensor_id in entry[1]
+            or far_apart
+        ):
+            self._emit(self._pending.pop(event.address))
+            entry = None
+        if entry is None:
+            entry = self._pending[event.address] = [timestamp, [], [], event, far_apart]
+        entry[1].append(sensor_id)
+        entry[2].append(rssi)
+
+    def _emit(self, entry):
+        timestamp, sensors, rssi, event, far_apart = entry
+        self.counts["sightings"] += 1
+        self.handle_sighting(
+            Sighting(
+                event.address,
+                event.pdu_type,
+                timestamp,
+                tuple(sensors),
+                tuple(rssi),
+                event.payload,
+                tuple(far_apart),
+            )
+        )
+
+
+def far_apart_sensors(sensors, positions, distance):
+    """
+    서로 distance(m)보다 멀리 떨어진 센서 쌍을 찾습니다.
+    :return: (센서 A, 센서 B, 거리) 리스트 (좌표가 없는 센서는 제외)
+    """
+    pairs = []
+    for a, b in itertools.combinations(sensors, 2):
+        if a not in positions or b not in positions:
+            continue
+        d = math.dist(positions[a], positions[b])
+        if d > distance:
+            pairs.append((a, b, d))
+    return pairs
+
+
+class _SensorHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        peer = "%s:%s" % self.client_address
+        print(f"센서 연결: {peer}")
+        while True:
+            body = recv_frame(self.request)
+            if body is None:
+                break
+            try:
+                sensor_id, send_time, events = decode_batch(body)
+            except Exception as e:
+                print(f"배치 해석 오류 ({peer}): {e}")
+                break
+            self.server.aggregator.add_batch(sensor_id, send_time, events)
+        print(f"센서 연결 종료: {peer}")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(aggregator, host="0.0.0.0", port=7000):
+    """센서 연결을 받는 TCP 서버를 백그라운드 스레드로 시작 (port=0이면 임의 포트)"""
+    server = _Server((host, port), _SensorHandler)
+    server.aggregator = aggregator
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_detector(target_uuid="all", profiles=None, rollup=None):
+    """
+    Sighting마다 원거리 동시 관측과 광고 간격을 검사하는 함수를 만듭니다.
+    :param profiles: 임계값을 조회할 프로필 컬렉션 (None이면 조회마다 새로 연결)
+    :param rollup: (선택) 측정한 간격과 RSSI를 누적할 IntervalRollup
+    """
+    last_timestamps = {}
+    distance = AGGREGATOR_CONFIG["far_apart_distance"]
+
+    def handle_sighting(sighting):
+        if sighting.far_apart:
+            reasons = [
+                f"센서 {a} ↔ {b}: {d:.1f}m > 허용 {distance:.1f}m"
+                for a, b, d in sighting.far_apart
+            ]
+            print(f"[!] 원거리 동시 관측! ({sighting.address})")
+            for reason in reasons:
+                print(f"    {reason}")
+            send_alert_email(
+                sighting.address, None, None, reason="원거리 동시 관측, " + ", ".join(reasons)
+            )
+
+        device_id = target_uuid if target_uuid != "all" else sighting.address
+        delta = check_interval(last_timestamps, device_id, sighting.timestamp, profiles)
+
+        if rollup is not None and delta is not None:
+            rssi = [value for value in sighting.rssi if value is not None]
+            rollup.add(
+                device_id,
+                sighting.timestamp,
+                delta,
+                sum(rssi) / len(rssi) if rssi else None,
+            )
+
+    return handle_sighting
+
+
+def reorder_delay_from_config():
+    """
+    AGGREGATOR_CONFIG의 reorder_delay (None이면 센서 최대 전송 지연 + network_margin).
+    센서 최대 전송 지연보다 짧게 설정되어 있으면 경고를 출력합니다.
+    """
+    minimum = max_event_delay(SENSOR_CONFIG["batch_interval"], SENSOR_CONFIG["idle_flush"])
+    reorder_delay = AGGREGATOR_CONFIG["reorder_delay"]
+    if reorder_delay is None:
+        return minimum + AGGREGATOR_CONFIG["network_margin"]
+    if reorder_delay < minimum:
+        print(
+            f"경고: reorder_delay {reorder_delay:.2f}s가 센서 최대 전송 지연 {minimum:.2f}s보다 "
+            "짧아 정상 이벤트도 늦게 도착한 것으로 버려질 수 있습니다."
+        )
+    return reorder_delay
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else AGGREGATOR_CONFIG["port"]
+    target_uuid = sys.argv[2].lower() if len(sys.argv) > 2 else "all"
+    reorder_delay = reorder_delay_from_config()
+
+    client = MongoClient(MONGO_URI)
+    rollup = open_rollup()
+    aggregator = Aggregator(
+        make_detector(target_uuid, client[DB_NAME][COLLECTION_NAME], rollup),
+        reorder_delay=reorder_delay,
+        merge_window=AGGREGATOR_CONFIG["merge_window"],
+        offset_samples=AGGREGATOR_CONFIG["offset_samples"],
+        sensor_positions=AGGREGATOR_CONFIG["sensor_positions"],
+        far_apart_distance=AGGREGATOR_CONFIG["far_apart_distance"],
+    )
+    server = start_server(aggregator, port=port)
+    print(
+        f"애그리게이터 시작 (포트: {port}, 대상 UUID: {target_uuid}, "
+        f"reorder_delay: {reorder_delay:.2f}s)"
+    )
+    if not AGGREGATOR_CONFIG["sensor_positions"]:
+        print("sensor_positions가 비어 있어 원거리 동시 관측을 검사하지 않습니다.")
+
+    last_report = time.time()
+    reported_late = 0
+    try:
+        while True:
+            time.sleep(0.05)
+            aggregator.release()
+
+            now = time.time()
+            if now - last_report >= AGGREGATOR_CONFIG["report_interval"]:
+                last_report = now
+                late = aggregator.counts["late"]
+                if late > reported_late:
+                    print(
+                        f"[!] 늦게 도착해 버린 이벤트 {late - reported_late}개 "
+                        f"(누적 {late}개, reorder_delay {reorder_delay:.2f}s)"
+                    )
+                    reported_late = late
+    except KeyboardInterrupt:
+        print("\n애그리게이터 종료.")
+        server.shutdown()
+        aggregator.flush()
+        print(aggregator.counts)
+    finally:
+        if rollup is not None:
+            rollup.close()
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from capture import (
+    ADV_CHANNELS,
+    build_packet_filter,
+    coalesce_events,
+    iter_json_objects,
+    packet_from_json,
+    transform_uuid,
+)
+from detect import get_min_delta, measure_interval
+from packet import (
+    new_channel_data,
+    render_channel_table,
+    summarize_channel,
+    update_channel_data,
+)
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "adv_capture.json")
+DEFAULT_UUID = "12345678-1234-1234-1234-1234567890ab"
+
+
+class LocalCollection:
+    """mongomock이 없을 때 사용하는 임계값 컬렉션 대용 (get_min_delta의 $or 조회만 지원)"""
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def find_one(self, query):
+        for document in self.documents:
+            for condition in query["$or"]:
+                if all(document.get(key) == value for key, value in condition.items()):
+                    return document
+        return None
+
+
+def threshold_collection(documents):
+    """임계값 문서를 담은 컬렉션 (mongomock 우선, 없으면 LocalCollection)"""
+    try:
+        import mongomock
+    except ImportError:
+        return LocalCollection(documents), "local"
+    collection = mongomock.MongoClient()["ble_data"]["uuid_analysis_results"]
+    collection.insert_many([dict(document) for document in documents])
+    return collection, "mongomock"
+
+
+def load_fixture(path):
+    """tshark -T json 형식 파일을 줄 단위로 읽고, 파싱된 객체/패킷도 미리 준비"""
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    objects = list(iter_json_objects(lines))
+    packets = [packet_from_json(obj) for obj in objects]
+    return lines, objects, packets
+
+
+def build_stages(lines, objects, packets):
+    """
+    단계별 벤치마크 함수 목록을 만듭니다.
+    :return: ([(단계 이름, 1회 실행 시 처리 항목 수, 함수)] 리스트, 임계값 조회 백엔드)
+    """
+    matches = build_packet_filter("all", DEFAULT_UUID)
+    matched = [packet for packet in packets if matches(packet)]
+    addresses = sorted({packet.address for packet in matched})
+
+    collection, backend = threshold_collection(
+        [{"advertising_address": address, "advertising_interval": 0.1} for address in addresses]
+    )
+
+    events = list(coalesce_events(matched))
+
+    channel_data = {channel: new_channel_data() for channel in ADV_CHANNELS}
+    for packet in matched:
+        if packet.channel in channel_data:
+            update_channel_data(channel_data[packet.channel], packet.timestamp, packet.rssi)
+    target_num_packet = min(data["packet_count"] for data in channel_data.values()) - 1
+    channel_results = {
+        channel: summarize_channel(channel, data, target_num_packet)
+        for channel, data in channel_data.items()
+    }
+
+    def reassemble():
+        for _ in iter_json_objects(lines):
+            pass
+
+    def decode():
+        for obj in objects:
+            packet_from_json(obj)
+
+    def uuid_transform():
+        for _ in packets:
+            transform_uuid(DEFAULT_UUID)
+
+    def filter_eval():
+        for packet in packets:
+            matches(packet)
+
+    def coalesce():
+        for _ in coalesce_events(matched):
+            pass
+
+    def threshold_lookup():
+        # detect.py와 같이 열어 둔 컬렉션 하나로 이벤트마다 조회
+        for event in events:
+            get_min_delta(event.address, collection)
+
+    def interval_update():
+        last_timestamps = {}
+        for event in events:
+            measure_interval(last_timestamps, event.address, event.timestamp)
+
+    def stats_update():
+        data = {channel: new_channel_data() for channel in ADV_CHANNELS}
+        for event in events:
+            for channel, timestamp, rssi in zip(
+                event.channels, event.timestamps, event.rssi
+            ):
+                if channel in data:
+                    update_channel_data(data[channel], timestamp, rssi)
+
+    def stats_summary():
+        for channel in ADV_CHANNELS:
+            summarize_channel(channel, channel_data[channel], target_num_packet)
+
+    def table_render():
+        render_channel_table(channel_results, target_num_packet)
+
+    stages = [
+        ("reassemble", len(objects), reassemble),
+        ("decode", len(objects), decode),
+        ("transform_uuid", len(packets), uuid_transform),
+        ("filter", len(packets), filter_eval),
+        ("coalesce", len(matched), coalesce),
+        ("threshold_lookup", len(events), threshold_lookup),
+        ("interval_update", len(events), interval_update),
+        ("stats_update", len(events), stats_update),
+        ("stats_summary", len(ADV_CHANNELS), stats_summary),
+        ("table_render", 1, table_render),
+    ]
+    return stages, backend
+
+
+def time_stage(func, repeat, min_time=0.05):
+    """
+    func를 반복 실행해 1회 실행 시간(초)의 중앙값을 구합니다.
+    한 번의 측정이 min_time 이상이 되도록 내부 반복 횟수를 정합니다.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - start) / loops)
+    return statistics.median(samples)
+
+
+def run(fixture, repeat):
+    lines, objects, packets = load_fixture(fixture)
+    stages, backend = build_stages(lines, objects, packets)
+    results = {}
+    for name, items, func in stages:
+        seconds = time_stage(func, repeat)
+        results[name] = {
+            "seconds": seconds,
+            "items": items,
+            "ns_per_item": seconds / items * 1e9,
+        }
+        print(f"{name:<32} {results[name]['ns_per_item']:>12.1f} ns/item  ({items} items)")
+    return {
+        "fixture": os.path.basename(fixture),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "backend": backend,
+        "stages": results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    기준 결과와 비교해 threshold(%) 이상 느려진 단계와 비교할 수 없는 단계를 찾습니다.
+    기준에 없는 단계, 임계값 조회 백엔드가 기준과 다를 때의 threshold_lookup은
+    비교할 수 없는 단계로 봅니다.
+    :return: ([(단계 이름, 기준 ns/item, 현재 ns/item, 변화율 %)] 리스트, [비교할 수 없는 단계 이름])
+    """
+    regressions = []
+    missing = []
+    print(f"\n기준 대비 변화 (허용: +{threshold:.1f}%)")
+
+    backend_mismatch = baseline.get("backend") != results["backend"]
+    if backend_mismatch:
+        print(
+            f"임계값 조회 백엔드가 기준과 다름: 기준 {baseline.get('backend')}, "
+            f"현재 {results['backend']}"
+        )
+
+    for name, current in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None or (name == "threshold_lookup" and backend_mismatch):
+            print(f"{name:<32} {'(비교 불가)':>12}")
+            missing.append(name)
+            continue
+        change = (current["ns_per_item"] / base["ns_per_item"] - 1) * 100
+        mark = "REGRESSION" if change > threshold else ""
+        print(f"{name:<32} {change:>+11.1f}%  {mark}")
+        if change > threshold:
+            regressions.append((name, base["ns_per_item"], current["ns_per_item"], change))
+    return regressions, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="캡처/필터/조회/탐지 핫패스 마이크로벤치마크"
+    )
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE, help="tshark -T json 형식 파일 (기본값: 합성 캡처 fixtures/adv_capture.json)")
+    parser.add_argument("--output", default="bench_results.json", help="결과 JSON 파일")
+    parser.add_argument("--baseline", help="비교할 기준 결과 JSON 파일")
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="허용 성능 저하 비율 (%%, 기본값: 10)"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="단계별 측정 횟수 (기본값: 5)")
+    args = parser.parse_args()
+
+    results = run(args.fixture, args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"결과 저장: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions, missing = compare(results, baseline, args.threshold)
+        if missing:
+            print("기준과 비교할 수 없는 단계가 있습니다. 같은 환경에서 기준을 다시 기록하세요.")
+        if regressions or missing:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+import json
+import subprocess
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+# 광고 PDU 타입 (btle.advertising_header.pdu_type)
+PDU_ADV_IND = 0x00
+
+# 광고 채널
+ADV_CHANNELS = (37, 38, 39)
+
+# 패킷 한 개를 나타내는 불변 레코드. tshark JSON을 한 번만 파싱해 만든다.
+#   address:   광고 주소 (디바이스 키, 예: "72:cf:4d:7d:8e:58")
+#   channel:   수신 채널 (int, 없으면 None)
+#   pdu_type:  광고 PDU 타입 (int, 없으면 None)
+#   timestamp: frame.time_epoch (float)
+#   rssi:      수신 세기 (float, 없으면 None)
+#   payload:   광고 데이터 엔트리 바이트 (예: iBeacon "02 15 <UUID> ...")
+BlePacket = namedtuple(
+    "BlePacket", ["address", "channel", "pdu_type", "timestamp", "rssi", "payload"]
+)
+
+# 광고 이벤트: 한 디바이스가 37/38/39 채널로 연속 전송한 같은 PDU 묶음
+#   address, pdu_type, payload: 이벤트를 이루는 패킷들의 공통 값
+#   timestamp:  첫 패킷 시각
+#   channels:   수신 채널 튜플 (수신 순서)
+#   timestamps: 채널별 수신 시각 튜플
+#   rssi:       채널별 RSSI 튜플
+AdvEvent = namedtuple(
+    "AdvEvent",
+    ["address", "pdu_type", "timestamp", "channels", "timestamps", "rssi", "payload"],
+)
+
+# 한 광고 이벤트로 묶을 최대 시간 폭 (초). BLE 광고 이벤트는 10ms 이내에 끝난다.
+DEFAULT_EVENT_WINDOW = 0.010
+
+
+def find_interface():
+    """
+    nRF Sniffer for Bluetooth LE 장치의 인터페이스 이름을 찾습니다.
+
+    Returns:
+        str: 찾은 인터페이스 이름 (예: /dev/ttyACM0-4.2) 또는 None (찾지 못한 경우).
+    """
+    print("Finding nRF Sniffer interface...")
+    try:
+        result = subprocess.run(
+            ["tshark", "-D"], capture_output=True, text=True, check=True
+        )
+        for line in result.stdout.splitlines():
+            if "nRF Sniffer for Bluetooth LE" in line:
+                parts = line.split()
+                if len(parts) > 1:
+                    interface = parts[1].strip()
+                    print(f"Found nRF Sniffer interface: {interface}")
+                    return interface
+    except FileNotFoundError:
+        print(
+            "Error: tshark not found. Please make sure it is installed and in your PATH."
+        )
+        return None
+    except subprocess.CalledProcessError as e:
+        print(f"Error running tshark -D: {e}")
+        return None
+    print("Error: Could not find nRF Sniffer interface.")
+    return None
+
+
+def transform_uuid(uuid_str):
+    """
+    UUID 문자열을 tshark가 출력하는 iBeacon 광고 데이터 형식으로 변환합니다.
+
+    Args:
+      uuid_str: 변환할 UUID 문자열 (예: "12345678-1234-1234-1234-1234567890AB")
+
+    Returns:
+      변환된 문자열 (예: "02:15:12:34:56:78:12:34:12:34:12:34:12:34:56:78:90:ab:00:01:00:01:c5").
+      UUID 형식이 아니면 입력 문자열을 그대로 반환합니다.
+    """
+    try:
+        hex_str = uuid.UUID(uuid_str).hex
+    except ValueError:
+        return uuid_str
+    hex_parts = [hex_str[i : i + 2] for i in range(0, len(hex_str), 2)]
+    return "02:15:" + ":".join(hex_parts) + ":00:01:00:01:c5"
+
+
+def uuid_to_payload(uuid_str):
+    """
+    UUID(또는 콜론 구분 16진수 문자열)를 BlePacket.payload와 비교할 바이트로 변환합니다.
+    변환할 수 없으면 None을 반환합니다.
+    """
+    try:
+        return bytes.fromhex(transform_uuid(uuid_str).replace(":", ""))
+    except ValueError:
+        return None
+
+
+def build_packet_filter(advertising_address, uuid_filter):
+    """
+    광고 주소/UUID 필터 함수를 만듭니다. UUID 변환은 여기서 한 번만 수행합니다.
+
+    :param advertising_address: 필터링할 광고 주소 또는 "all"
+    :param uuid_filter: 필터링할 UUID 또는 "all"
+    :return: BlePacket을 받아 조건에 맞으면 True를 반환하는 함수
+    """
+    address = None if advertising_address == "all" else advertising_address
+    match_uuid = uuid_filter != "all"
+    payload = uuid_to_payload(uuid_filter) if match_uuid else None
+
+    def matches(packet):
+        if packet.pdu_type != PDU_ADV_IND:
+            return False
+        if address is not None and packet.address != address:
+            return False
+        if match_uuid and packet.payload != payload:
+            return False
+        return True
+
+    return matches
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value, base=10):
+    try:
+        return int(value, base)
+    except (TypeError, ValueError):
+        return None
+
+
+def _entry_payload(btle):
+    """btcommon.eir_ad.entry.data 값을 바이트로 변환 (엔트리가 여러 개면 첫 데이터 엔트리)"""
+    entries = btle.get("btcommon.eir_ad.advertising_data", {}).get(
+        "btcommon.eir_ad.entry"
+    )
+    if isinstance(entries, dict):
+        entries = (entries,)
+    for entry in entries or ():
+        data = entry.get("btcommon.eir_ad.entry.data") if isinstance(entry, dict) else None
+        if data:
+            try:
+                return bytes.fromhex(data.replace(":", ""))
+            except ValueError:
+                return b""
+    return b""
+
+
+def packet_from_json(packet):
+    """tshark -T json 패킷 객체 하나를 BlePacket으로 변환"""
+    layers = packet.get("_source", {}).get("layers", {})
+    nordic_ble = layers.get("nordic_ble", {})
+    btle = layers.get("btle", {})
+
+    return BlePacket(
+        btle.get("btle.advertising_address"),
+        _to_int(nordic_ble.get("nordic_ble.channel")),
+        _to_int(
+            btle.get("btle.advertising_header_tree", {}).get(
+                "btle.advertising_header.pdu_type"
+            ),
+            16,
+        ),
+        _to_float(layers.get("frame", {}).get("frame.time_epoch")) or 0.0,
+        _to_float(nordic_ble.get("nordic_ble.rssi")),
+        _entry_payload(btle),
+    )
+
+
+def iter_json_objects(lines):
+    """
+    tshark -T json 출력(줄 단위)을 패킷 단위 JSON 객체로 재조립합니다.
+    최상위 "{" 줄이 나오면 그 전까지 모은 버퍼를 하나의 패킷으로 파싱합니다.
+    """
+    json_buffer = []
+    for line in lines:
+        line = line.strip()
+        if line == "{" and json_buffer:
+            try:
+                yield json.loads("\n".join(json_buffer).rstrip(",\n"))
+            except json.JSONDecodeError:
+                pass  # 첫 "[" 등 불완전한 조각은 무시
+            json_buffer = []
+        json_buffer.append(line)
+
+    # 스트림 끝: 마지막 패킷 처리 (닫는 "]" 제거)
+    if json_buffer:
+        try:
+            yield json.loads("\n".join(json_buffer).rstrip(",]\n"))
+        except json.JSONDecodeError:
+            pass
+
+
+def parse_tshark_json(lines):
+    """tshark -T json 출력 줄들로부터 BlePacket을 생성합니다."""
+    for packet in iter_json_objects(lines):
+        if isinstance(packet, dict):
+            yield packet_from_json(packet)
+
+
+class EventCoalescer:
+    """
+    37/38/39 채널 패킷을 광고 이벤트(AdvEvent)로 묶는 상태.
+
+    - add(packet): 패킷을 추가하고 끝난 이벤트 목록을 반환한다. 이벤트는 첫 패킷 이후
+      window(초)가 지나거나, 같은 채널이 다시 나오거나, 모든 광고 채널이 모이면 끝난다.
+    - expire(now): 첫 패킷 시각이 now - window보다 이른 이벤트를 내보낸다.
+    - advance(timestamp): 필터에 걸러진 패킷의 시각으로 expire()한다. 채널 사본 하나를
+      놓친 이벤트가 다음 매칭 패킷(한 광고 주기 뒤)까지 붙잡혀 있지 않게 한다.
+    - expire_idle(): 패킷이 들어오지 않는 동안 타이머에서 호출한다. 마지막 패킷 시각에
+      그 뒤로 흐른 벽시계 시간을 더한 시각으로 expire()하므로 재생 캡처에도 쓸 수 있다.
+    - flush(): 남은 이벤트를 모두 내보낸다.
+
+    패킷은 시간 순으로 들어온다고 가정한다. expire()로 이미 내보낸 이벤트의 늦은
+    채널 사본은 새 이벤트로 만들지 않고 버린다 (late_copies).
+    스레드에 안전하지 않으므로 여러 스레드에서 쓸 때는 호출하는 쪽에서 잠가야 한다.
+    """
+
+    def __init__(self, window=DEFAULT_EVENT_WINDOW):
+        self.window = window
+        self.late_copies = 0
+        # (주소, PDU 타입) -> [첫 패킷, 채널, 시각, RSSI] (시작 순)
+        self._pending = OrderedDict()
+        # expire()로 내보낸 이벤트: (주소, PDU 타입) -> (첫 패킷 시각, 채널 목록)
+        self._expired = {}
+        self._clock = None  # (마지막 패킷 시각, 그 패킷을 받은 벽시계 시각)
+
+    def add(self, packet):
+        events = self.advance(packet.timestamp)
+
+        key = (packet.address, packet.pdu_type)
+        expired = self._expired.get(key)
+        if (
+            expired is not None
+            and packet.timestamp - expired[0] <= self.window
+            and packet.channel not in expired[1]
+        ):
+            self.late_copies += 1
+            return events
+
+        entry = self._pending.get(key)
+        if entry is not None and (
+            packet.channel in entry[1] or packet.payload != entry[0].payload
+        ):
+            events.append(_finish_event(self._pending.pop(key)))
+            entry = None
+        if entry is None:
+            entry = self._pending[key] = [packet, [], [], []]
+
+        entry[1].append(packet.channel)
+        entry[2].append(packet.timestamp)
+        entry[3].append(packet.rssi)
+
+        if len(entry[1]) == len(ADV_CHANNELS):
+            events.append(_finish_event(self._pending.pop(key)))
+        return events
+
+    def advance(self, timestamp):
+        """캡처한 패킷 시각까지 시간을 진행하고 시간 창이 지난 이벤트를 반환"""
+        self._clock = (timestamp, time.time())
+        return self.expire(timestamp)
+
+    def expire_idle(self, now=None):
+        """마지막 패킷 이후 흐른 벽시계 시간만큼 시간을 진행하고 끝난 이벤트를 반환"""
+        if self._clock is None:
+            return []
+        now = time.time() if now is None else now
+        last_timestamp, last_seen = self._clock
+        return self.expire(last_timestamp + max(0.0, now - last_seen))
+
+    def expire(self, now):
+        # 시간 창이 지난 기록 정리
+        for key in [
+            key
+            for key, (timestamp, _) in self._expired.items()
+            if now - timestamp > self.window
+        ]:
+            del self._expired[key]
+
+        # 시간 창이 지난 이벤트 방출 (가장 오래된 것부터)
+        events = []
+        while self._pending:
+            key, entry = next(iter(self._pending.items()))
+            if now - entry[0].timestamp <= self.window:
+                break
+            del self._pending[key]
+            self._expired[key] = (entry[0].timestamp, entry[1])
+            events.append(_finish_event(entry))
+        return events
+
+    def flush(self):
+        events = [_finish_event(entry) for entry in self._pending.values()]
+        self._pending.clear()
+        return events
+
+
+def coalesce_events(packets, window=DEFAULT_EVENT_WINDOW):
+    """
+    같은 디바이스가 37/38/39 채널로 보낸 패킷을 광고 이벤트(AdvEvent)로 묶습니다.
+    이벤트는 첫 패킷 이후 window(초)가 지나거나, 같은 채널이 다시 나오거나,
+    모든 광고 채널이 모이면 방출됩니다. 패킷은 시간 순으로 들어온다고 가정합니다.
+
+    시간 창은 다음 패킷이 들어올 때 검사하므로, 채널 사본을 놓친 이벤트는 다음
+    패킷까지 붙잡혀 있습니다. 실시간 처리에서는 EventCoalescer.expire()를 함께 쓰세요.
+
+    :param packets: BlePacket 이터러블
+    :param window: 한 이벤트로 묶을 최대 시간 폭 (초)
+    :return: AdvEvent 제너레이터
+    """
+    coalescer = EventCoalescer(window)
+    for packet in packets:
+        yield from coalescer.add(packet)
+    # 스트림 끝: 남은 이벤트 방출
+    yield from coalescer.flush()
+
+
+def _finish_event(entry):
+    first, channels, timestamps, rssi = entry
+    return AdvEvent(
+        first.address,
+        first.pdu_type,
+        first.timestamp,
+        tuple(channels),
+        tuple(timestamps),
+        tuple(rssi),
+        first.payload,
+    )
+
+
+class PacketSource:
+    """
+    BlePacket 소스 기본 클래스.
+    하위 클래스는 lines()를 구현해 tshark -T json 형식의 줄을 제공하거나,
+    __iter__를 직접 구현해 BlePacket을 생성하면 됩니다.
+    """
+
+    def lines(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        return parse_tshark_json(self.lines())
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class TsharkSource(PacketSource):
+    """실시간 tshark 캡처 소스"""
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.process = None
+
+    def lines(self):
+        cmd = ["tshark", "-i", self.interface, "-T", "json"]
+        self.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1,
+            universal_newlines=True,
+        )
+        return self.process.stdout
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process = None
+
+
+class FileSource(PacketSource):
+    """저장된 tshark -T json 출력 파일 소스 (재생/테스트용)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def lines(self):
+        self.file = open(self.path, encoding="utf-8")
+        return self.file
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ReplaySource(PacketSource):
+    """
+    다른 패킷 소스를 실시간으로 재생하는 소스 (센서/애그리게이터 로컬 시험용).
+    원본 시각 epoch가 벽시계 start(+ offset)가 되도록 모든 패킷 시각을 옮기고,
+    원래 간격대로 기다렸다가 내보냅니다.
+    """
+
+    def __init__(self, source, offset=0.0, epoch=None, start=None):
+        """
+        :param source: 원본 패킷 소스 (예: FileSource)
+        :param offset: 재생 시각에 더할 값 (초, 센서 시계 오차 재현용)
+        :param epoch: start에 맞출 원본 시각 (None이면 첫 패킷 시각)
+        :param start: 재생 시작 벽시계 시각 (None이면 첫 패킷을 읽은 시각).
+                      여러 소스를 같은 시각에 맞춰 재생할 때 지정한다.
+        """
+        self.source = source
+        self.offset = offset
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        shift = None
+        for packet in self.source:
+            if shift is None:
+                epoch = packet.timestamp if self.epoch is None else self.epoch
+                start = time.time() if self.start is None else self.start
+                shift = start - epoch
+            delay = packet.timestamp + shift - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            yield packet._replace(timestamp=packet.timestamp + shift + self.offset)
+
+    def close(self):
+        self.source.close()
@@ -1,14 +1,21 @@
-import uuid
-import subprocess
-import json
 import sys
-import time
 from pymongo import MongoClient
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 
+from capture import (
+    DEFAULT_EVENT_WINDOW,
+    EventCoalescer,
+    TsharkSource,
+    build_packet_filter,
+    find_interface,
+    uuid_to_payload,
+)
+from overload import LoadShedder, SheddingSource
+from rollup import IntervalRollup
+
 # MongoDB 설정
 MONGO_URI = "mongodb://localhost:27017/"
 DB_NAME = "ble_data"
@@ -23,28 +30,59 @@ EMAIL_CONFIG = {
     "receiver_email": "receiver_email@example.com",
 }
 
+# 캡처 저장소 설정 (매칭된 광고 패킷을 디스크에 기록, numpy 필요)
+STORE_CONFIG = {
+    "enabled": False,
+    "path": "capture_store",
+    "segment_seconds": 3600,  # 세그먼트 회전 주기 (초)
+    "retention_segments": 24,  # 보관할 세그먼트 수
+    "batch_size": 256,  # 디스크 기록 배치 크기 (패킷 수)
+}
 
-def find_interface():
-    """nRF Sniffer 인터페이스 자동 탐색"""
-    try:
-        result = subprocess.run(
-            ["tshark", "-D"], capture_output=True, text=True, check=True
-        )
-        for line in result.stdout.splitlines():
-            if "nRF Sniffer for Bluetooth LE" in line:
-                parts = line.split()
-                if len(parts) > 1:
-                    return parts[1].strip()
-        return None
-    except Exception as e:
-        print(f"인터페이스 찾기 오류: {e}")
-        return None
+# 과부하 설정 (캡처 지연/대기 큐가 커지면 프로필이 없는 디바이스의 광고 이벤트를 버림)
+OVERLOAD_CONFIG = {
+    "enabled": True,
+    "lag_high": 2.0,  # 과부하 진입 캡처 지연 (초)
+    "lag_low": 0.5,  # 과부하 해제 캡처 지연 (초)
+    "queue_high": 5000,  # 과부하 진입 대기 이벤트 수
+    "queue_low": 500,  # 과부하 해제 대기 이벤트 수
+    "sample_rate": 0,  # 과부하 시 비보호 이벤트 N개 중 1개만 처리 (0이면 모두 버림)
+    "watchlist": [],  # 항상 처리할 광고 주소 또는 UUID
+    "refresh_interval": 60,  # 보호 디바이스 목록 갱신 주기 (초)
+    "report_interval": 10,  # 과부하 중 상태 출력 주기 (초)
+}
+
+# 롤업 설정 (프로필이 있는 디바이스의 광고 간격/RSSI를 시간 버킷별로 누적)
+ROLLUP_CONFIG = {
+    "enabled": True,
+    "collection": "device_rollups",
+    "reprofile_collection": "reprofile_requests",  # 드리프트로 재프로파일링이 필요한 디바이스
+    "buckets": {"1m": 60, "1h": 3600, "1d": 86400},  # 버킷 이름 -> 길이 (초)
+    "flush_interval": 10,  # MongoDB 기록 주기 (초)
+    "drift_bucket": "1h",  # 드리프트를 검사할 버킷
+    "drift_min_samples": 100,  # 드리프트 검사에 필요한 최소 간격 수
+    "interval_drift_limit": 0.10,  # 허용 평균 간격 변화율 (10%)
+    "rssi_drift_limit": 10.0,  # 허용 평균 RSSI 변화 (dB)
+}
 
 
-def send_alert_email(device_info, delta_time, min_delta):
+def send_alert_email(device_info, delta_time, min_delta, reason=None):
+    """
+    스푸핑 경고 이메일 전송
+    delta_time/min_delta가 None이면 간격 항목을 빼고, reason이 있으면 탐지 사유를 덧붙입니다.
+    """
     
     subject = f"⚠️ [BLE Spoof Alert] {device_info}"
     
+    details = ""
+    if delta_time is not None:
+        details += f"""
+            <p class="alert">🚨 <strong>측정 간격:</strong> {delta_time:.6f} 초</p>
+            <p class="alert">⛔ <strong>허용 최소 간격:</strong> {min_delta:.6f} 초</p>"""
+    if reason:
+        details += f"""
+            <p class="alert">📍 <strong>탐지 사유:</strong> {reason}</p>"""
+
     # HTML 이메일 본문
     body = f"""
     <html>
@@ -90,9 +128,7 @@ def send_alert_email(device_info, delta_time, min_delta):
         <div class="container">
             <h2>⚠️ BLE 패킷 스푸핑 탐지됨!</h2>
             <p><strong>🔍 디바이스 맥 주소:</strong> {device_info}</p>
-            <p><strong>⏰ 탐지 시간:</strong> {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>
-            <p class="alert">🚨 <strong>측정 간격:</strong> {delta_time:.6f} 초</p>
-            <p class="alert">⛔ <strong>허용 최소 간격:</strong> {min_delta:.6f} 초</p>
+            <p><strong>⏰ 탐지 시간:</strong> {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>{details}
             
             <p>📡 즉시 대응이 필요합니다!</p>
             
@@ -127,111 +163,233 @@ def send_alert_email(device_info, delta_time, min_delta):
     except Exception as e:
         print(f"이메일 전송 실패: {e}")
 
-def get_min_delta(device_id):
-    """MongoDB에서 디바이스의 최소 허용 간격 조회"""
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    collection = db[COLLECTION_NAME]
+def get_min_delta(device_id, collection=None):
+    """
+    MongoDB에서 디바이스의 최소 허용 간격 조회
+    collection을 지정하면 새로 연결하지 않고 해당 컬렉션에서 조회합니다.
+    """
+    client = None
+    if collection is None:
+        client = MongoClient(MONGO_URI)
+        collection = client[DB_NAME][COLLECTION_NAME]
 
     query = {"$or": [{"uuid": device_id}, {"advertising_address": device_id}]}
     entry = collection.find_one(query)
-    client.close()
+    if client is not None:
+        client.close()
 
     return entry.get("advertising_interval") if entry else None
 
 
-def monitor_ble_traffic(interface, target_addr, target_uuid):
-    """BLE 트래픽 모니터링 및 이상 패킷 감지"""
-    last_timestamps = {}
+def measure_interval(last_timestamps, device_id, timestamp):
+    """
+    디바이스의 직전 광고 이벤트와의 시간 간격을 계산하고 마지막 시각을 갱신합니다.
+    :return: 시간 간격 (초), 첫 이벤트면 None
+    """
+    last_time = last_timestamps.get(device_id)
+    last_timestamps[device_id] = timestamp
+    return None if last_time is None else timestamp - last_time
+
+
+def check_interval(last_timestamps, device_id, timestamp, collection=None):
+    """
+    프로필이 저장된 디바이스의 광고 이벤트 간격을 검사하고, 허용 최소 간격보다
+    짧으면 스푸핑으로 보고 경고 이메일을 보냅니다.
+    :param collection: 프로필 컬렉션 (None이면 조회마다 새로 연결)
+    :return: 측정한 간격 (초), 프로필이 없거나 첫 이벤트면 None
+    """
+    min_delta = get_min_delta(device_id, collection)
+
+    if not min_delta:
+        return None
+
+    # 시간 간격 계산 (광고 이벤트 간격)
+    delta = measure_interval(last_timestamps, device_id, timestamp)
 
-    cmd = ["tshark", "-i", interface, "-T", "json"]
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        bufsize=1,
-        universal_newlines=True,
+    if delta is not None:
+        print(delta)
+        if delta < (min_delta - 0.010):  # INT 검사 시 10ms 오차 고려
+            print(f"[!] 스푸핑 탐지! ({device_id})")
+            print(
+                f"    측정 간격: {delta:.6f}s < 허용 최소(Tlb - 10ms): {(min_delta - 0.010):.6f}s"
+            )
+            send_alert_email(device_id, delta, min_delta - 0.010)
+
+    return delta
+
+
+def open_capture_store():
+    """STORE_CONFIG가 활성화되어 있으면 캡처 저장소를 엽니다."""
+    if not STORE_CONFIG["enabled"]:
+        return None
+    from store import CaptureStore
+
+    return CaptureStore(
+        STORE_CONFIG["path"],
+        segment_seconds=STORE_CONFIG["segment_seconds"],
+        retention_segments=STORE_CONFIG["retention_segments"],
+        batch_size=STORE_CONFIG["batch_size"],
     )
 
+
+def load_protected_devices(collection=None):
+    """
+    항상 처리할 디바이스 목록: MongoDB에 프로필이 저장된 디바이스와 감시 목록
+    :return: (광고 주소 집합, UUID 광고 데이터 바이트 집합)
+    """
+    client = None
+    if collection is None:
+        client = MongoClient(MONGO_URI)
+        collection = client[DB_NAME][COLLECTION_NAME]
+
+    try:
+        entries = list(
+            collection.find({}, {"_id": 0, "uuid": 1, "advertising_address": 1})
+        )
+    finally:
+        if client is not None:
+            client.close()
+
+    device_ids = list(OVERLOAD_CONFIG["watchlist"])
+    for entry in entries:
+        device_ids.extend(
+            entry[key] for key in ("uuid", "advertising_address") if entry.get(key)
+        )
+
+    addresses, payloads = set(), set()
+    for device_id in device_ids:
+        addresses.add(device_id)
+        payload = uuid_to_payload(device_id)
+        if payload:
+            payloads.add(payload)
+    return addresses, payloads
+
+
+def open_load_shedder(profiles=None):
+    """
+    OVERLOAD_CONFIG가 활성화되어 있으면 과부하 정책을 만듭니다.
+    :param profiles: 보호 디바이스 목록을 읽을 프로필 컬렉션 (None이면 갱신마다 새로 연결)
+    """
+    if not OVERLOAD_CONFIG["enabled"]:
+        return None
+    return LoadShedder(
+        lambda: load_protected_devices(profiles),
+        lag_high=OVERLOAD_CONFIG["lag_high"],
+        lag_low=OVERLOAD_CONFIG["lag_low"],
+        queue_high=OVERLOAD_CONFIG["queue_high"],
+        queue_low=OVERLOAD_CONFIG["queue_low"],
+        sample_rate=OVERLOAD_CONFIG["sample_rate"],
+        refresh_interval=OVERLOAD_CONFIG["refresh_interval"],
+        report_interval=OVERLOAD_CONFIG["report_interval"],
+    )
+
+
+def open_rollup():
+    """
+    ROLLUP_CONFIG가 활성화되어 있으면 디바이스 롤업을 만듭니다.
+    롤업이 MongoDB 연결을 가지고 있다가 close() 시 닫습니다.
+    """
+    if not ROLLUP_CONFIG["enabled"]:
+        return None
+    client = MongoClient(MONGO_URI)
+    db = client[DB_NAME]
+    return IntervalRollup(
+        db[ROLLUP_CONFIG["collection"]],
+        reprofile=db[ROLLUP_CONFIG["reprofile_collection"]],
+        profiles=db[COLLECTION_NAME],
+        buckets=ROLLUP_CONFIG["buckets"],
+        flush_interval=ROLLUP_CONFIG["flush_interval"],
+        drift_bucket=ROLLUP_CONFIG["drift_bucket"],
+        drift_min_samples=ROLLUP_CONFIG["drift_min_samples"],
+        interval_drift_limit=ROLLUP_CONFIG["interval_drift_limit"],
+        rssi_drift_limit=ROLLUP_CONFIG["rssi_drift_limit"],
+        client=client,
+    )
+
+
+def monitor_ble_traffic(
+    interface,
+    target_addr,
+    target_uuid,
+    source=None,
+    store=None,
+    event_window=DEFAULT_EVENT_WINDOW,
+    shedder=None,
+    rollup=None,
+    profiles=None,
+):
+    """
+    BLE 트래픽 모니터링 및 이상 패킷 감지
+    37/38/39 채널로 반복 전송된 패킷은 광고 이벤트 하나로 묶어 이벤트 단위로 검사합니다.
+    shedder를 지정하면 캡처를 별도 스레드에서 읽어 이벤트로 묶고, 과부하 시
+    보호 디바이스 이벤트만 우선 처리합니다.
+    rollup을 지정하면 측정한 간격과 RSSI를 디바이스별 시간 버킷에 누적합니다.
+    profiles를 지정하지 않으면 MongoDB 연결을 하나 열어 모든 임계값 조회에 사용합니다.
+    """
+    last_timestamps = {}
+
+    client = None
+    if profiles is None:
+        client = MongoClient(MONGO_URI)
+        profiles = client[DB_NAME][COLLECTION_NAME]
+
+    if source is None:
+        source = TsharkSource(interface)
+
     print(f"모니터링 시작 (인터페이스: {interface})...")
     print(f"대상 주소: {target_addr}, 대상 UUID: {target_uuid}")
 
-    json_buffer = []
-    for line in process.stdout:
-        try:
-            if line.strip() == "{" and json_buffer:
-                try:                
-                    packet = json.loads("\n".join(json_buffer).rstrip(",\n"))  # JSON 파싱
-                    layers = packet.get("_source", {}).get("layers", {})
-                    btle = layers.get("btle", {})
-                    nordic_ble = layers.get("nordic_ble", {})
-
-                    # 패킷 정보 추출
-                    address = btle.get("btle.advertising_address")
-                    pdu_type = btle.get("btle.advertising_header_tree", {}).get(
-                        "btle.advertising_header.pdu_type"
-                    )
-                    uuid_data = (
-                        btle.get("btcommon.eir_ad.advertising_data", {})
-                        .get("btcommon.eir_ad.entry", {})
-                        .get("btcommon.eir_ad.entry.data")
-                    )
-                    timestamp = float(layers.get("frame", {}).get("frame.time_epoch", 0))
-                    channel = nordic_ble.get("nordic_ble.channel")
-
-                    # 필터링 조건 확인
-                    addr_match = (target_addr == "all") or (address == target_addr)
-                    uuid_match = (target_uuid == "all") or (
-                        uuid_data == transform_uuid(target_uuid)
-                    )
-
-                    if (
-                        addr_match
-                        and uuid_match
-                        and pdu_type == "0x00"
-                        # and channel in ["37", "38", "39"]
-                    ):
-                        device_id = target_uuid if target_uuid != "all" else address
-                        min_delta = get_min_delta(device_id)
-
-                        if not min_delta:
-                            continue
-
-                        # 시간 간격 계산
-                        last_time = last_timestamps.get(device_id)
-                        current_time = timestamp
-
-                        if last_time is not None:
-                            delta = current_time - last_time
-                            print(delta)
-                            if delta < (min_delta - 0.010):  # INT 검사 시 10ms 오차 고려
-                                print(f"[!] 스푸핑 탐지! ({device_id})")
-                                print(
-                                    f"    측정 간격: {delta:.6f}s < 허용 최소(Tlb - 10ms): {(min_delta - 0.010):.6f}s"
-                                )
-                                send_alert_email(device_id, delta, min_delta - 0.010)
-
-                        last_timestamps[device_id] = current_time
-                    json_buffer = []
-                except json.JSONDecodeError as e:
-                    pass
-                finally:
-                    json_buffer = []
-            json_buffer.append(line.strip())
-        except KeyboardInterrupt:
-            print("\nBLE 패킷 캡처 종료.")
-            process.terminate()
-            sys.exit(1)
-
-
-def transform_uuid(uuid_str):
-    """UUID 변환 함수 (기존 코드와 동일)"""
+    matches = build_packet_filter(target_addr, target_uuid)
+    # 저장소에는 이벤트로 묶기 전 원본 패킷을 캡처 순서대로 기록
+    record = store.append if store is not None else None
+
+    def matched_events():
+        coalescer = EventCoalescer(event_window)
+        for packet in source:
+            # 필터링 조건 확인 (광고 주소, UUID, ADV_IND)
+            if not matches(packet):
+                # 걸러진 패킷의 시각으로도 시간 창이 지난 이벤트를 내보냄
+                yield from coalescer.advance(packet.timestamp)
+                continue
+            if record is not None:
+                record(packet)
+            yield from coalescer.add(packet)
+        yield from coalescer.flush()
+
+    if shedder is not None:
+        # 필터링/저장/이벤트 묶기는 읽기 스레드에서 하고, 과부하 처리는 이벤트 단위로
+        source = SheddingSource(source, shedder, matches, event_window, record)
+        events = source
+    else:
+        events = matched_events()
+
     try:
-        uuid_obj = uuid.UUID(uuid_str)
-        hex_str = uuid_obj.hex
-        return f"02:15:{':'.join([hex_str[i:i+2] for i in range(0, len(hex_str), 2)])}:00:01:00:01:c5"
-    except:
-        return uuid_str
+        for event in events:
+            device_id = target_uuid if target_uuid != "all" else event.address
+            delta = check_interval(
+                last_timestamps, device_id, event.timestamp, profiles
+            )
+
+            if rollup is not None and delta is not None:
+                rssi = [value for value in event.rssi if value is not None]
+                rollup.add(
+                    device_id,
+                    event.timestamp,
+                    delta,
+                    sum(rssi) / len(rssi) if rssi else None,
+                )
+    except KeyboardInterrupt:
+        print("\nBLE 패킷 캡처 종료.")
+        sys.exit(1)
+    finally:
+        # 소스가 정상 종료되어도 남은 배치를 기록
+        source.close()
+        if store is not None:
+            store.close()
+        if rollup is not None:
+            rollup.close()
+        if client is not None:
+            client.close()
 
 
 if __name__ == "__main__":
@@ -250,4 +408,18 @@ if __name__ == "__main__":
     target_addr = sys.argv[1]
     target_uuid = sys.argv[2].lower() if len(sys.argv) > 2 else "all"
 
-    monitor_ble_traffic(interface, target_addr, target_uuid)
+    # 임계값 조회와 보호 디바이스 목록 갱신이 같은 연결을 사용
+    client = MongoClient(MONGO_URI)
+    profiles = client[DB_NAME][COLLECTION_NAME]
+    try:
+        monitor_ble_traffic(
+            interface,
+            target_addr,
+            target_uuid,
+            store=open_capture_store(),
+            shedder=open_load_shedder(profiles),
+            rollup=open_rollup(),
+            profiles=profiles,
+        )
+    finally:
+        client.close()
@@ -0,0 +1,173 @@
+"""
+센서 여러 개와 애그리게이터를 한 컴퓨터(localhost)에서 실행하는 분산 모드 시험.
+
+nRF Sniffer 없이 합성 캡처(fixtures/adv_capture.json)를 실시간으로 재생합니다.
+- near-a: 캡처 그대로
+- near-b: 같은 캡처, 센서 시계가 +2초 어긋남 (애그리게이터가 오프셋을 보정해 near-a와 합쳐야 함)
+- far:    100m 떨어진 곳에서 72:cf:4d:7d:8e:58을 5ms 뒤에 복제해 보내는 비콘
+- sparse: 1초 간격 비콘, 39 채널 사본 누락 (늦게 도착해 버려지면 안 됨)
+
+MongoDB와 이메일 없이 실행되며, 결과를 검사해 실패하면 종료 코드 1을 반환합니다.
+사용법: python distributed_demo.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+from aggregator import Aggregator, reorder_delay_from_config, start_server
+from capture import BlePacket, FileSource, PacketSource, ReplaySource, coalesce_events
+from sensor import SENSOR_CONFIG, SensorClient, run_sensor
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "adv_capture.json")
+
+CLONED_ADDRESS = "72:cf:4d:7d:8e:58"
+SPARSE_ADDRESS = "5c:31:92:aa:20:01"
+SPARSE_EVENTS = 4
+CLOCK_SKEW = 2.0  # near-b 센서 시계 오차 (초)
+
+SENSOR_POSITIONS = {
+    "near-a": (0, 0),
+    "near-b": (10, 0),
+    "sparse": (5, 0),
+    "far": (100, 0),
+}
+FAR_APART_DISTANCE = 30.0
+
+
+class CloneSource(PacketSource):
+    """원본 캡처에서 한 주소의 패킷만 delay초 뒤로 옮겨 내보내는 복제 비콘"""
+
+    def __init__(self, source, address, delay):
+        self.source = source
+        self.address = address
+        self.delay = delay
+
+    def __iter__(self):
+        for packet in self.source:
+            if packet.address == self.address:
+                yield packet._replace(timestamp=packet.timestamp + self.delay)
+
+    def close(self):
+        self.source.close()
+
+
+class SparseSource(PacketSource):
+    """interval초 간격으로 37/38 채널만 보내는 비콘 (39 채널 사본 누락)"""
+
+    def __init__(self, address, count, interval, start):
+        self.packets = []
+        for k in range(count):
+            for i, channel in enumerate((37, 38)):
+                timestamp = start + k * interval + i * 0.0006
+                self.packets.append(BlePacket(address, channel, 0x00, timestamp, -60.0, b""))
+
+    def __iter__(self):
+        return iter(self.packets)
+
+
+def main():
+    sightings = []
+    reorder_delay = reorder_delay_from_config()
+    aggregator = Aggregator(
+        sightings.append,
+        reorder_delay=reorder_delay,
+        sensor_positions=SENSOR_POSITIONS,
+        far_apart_distance=FAR_APART_DISTANCE,
+    )
+    server = start_server(aggregator, host="127.0.0.1", port=0)
+    port = server.server_address[1]
+    print(f"애그리게이터: 127.0.0.1:{port}, reorder_delay {reorder_delay:.2f}s")
+
+    stop = threading.Event()
+
+    def release_loop():
+        while not stop.wait(0.05):
+            aggregator.release()
+
+    threading.Thread(target=release_loop, daemon=True).start()
+
+    # 모든 센서가 원본 캡처의 첫 패킷 시각을 같은 벽시계 시각에 맞춰 재생
+    with FileSource(FIXTURE) as source:
+        epoch = next(iter(source)).timestamp
+    start = time.time() + 0.5
+
+    def replay(source, offset=0.0):
+        return ReplaySource(source, offset, epoch=epoch, start=start)
+
+    # (센서 ID, 재생 소스, 배치 전송 시각 시계)
+    sensors = [
+        ("near-a", replay(FileSource(FIXTURE)), time.time),
+        (
+            "near-b",
+            replay(FileSource(FIXTURE), CLOCK_SKEW),
+            lambda: time.time() + CLOCK_SKEW,
+        ),
+        (
+            "far",
+            replay(CloneSource(FileSource(FIXTURE), CLONED_ADDRESS, 0.005)),
+            time.time,
+        ),
+        (
+            "sparse",
+            replay(SparseSource(SPARSE_ADDRESS, SPARSE_EVENTS, 1.0, epoch)),
+            time.time,
+        ),
+    ]
+    threads = []
+    for sensor_id, source, clock in sensors:
+        client = SensorClient(
+            "127.0.0.1",
+            port,
+            sensor_id,
+            batch_interval=SENSOR_CONFIG["batch_interval"],
+            clock=clock,
+        )
+        thread = threading.Thread(
+            target=run_sensor,
+            args=(client, source, "all", "all"),
+            kwargs={"idle_flush": SENSOR_CONFIG["idle_flush"]},
+        )
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    # 마지막 배치가 reorder_delay를 지나 방출될 때까지 대기
+    time.sleep(reorder_delay + SENSOR_CONFIG["batch_interval"] + 0.5)
+    stop.set()
+    server.shutdown()
+    aggregator.flush()
+
+    with FileSource(FIXTURE) as source:
+        expected = sum(
+            1 for event in coalesce_events(source) if event.address == CLONED_ADDRESS
+        )
+    cloned = [s for s in sightings if s.address == CLONED_ADDRESS]
+    merged = [s for s in cloned if {"near-a", "near-b"} <= set(s.sensors)]
+    far = [s for s in cloned if s.far_apart]
+    sparse = [s for s in sightings if s.address == SPARSE_ADDRESS]
+
+    print(aggregator.counts)
+    print(
+        f"{CLONED_ADDRESS}: 광고 이벤트 {expected}, near-a/near-b 병합 {len(merged)}, "
+        f"원거리 동시 관측 {len(far)}"
+    )
+    print(f"{SPARSE_ADDRESS}: Sighting {len(sparse)}/{SPARSE_EVENTS}")
+
+    checks = [
+        ("늦게 도착해 버린 이벤트 없음", aggregator.counts["late"] == 0),
+        ("시계가 어긋난 센서의 이벤트 병합", len(merged) == expected),
+        ("복제 비콘을 원거리 동시 관측으로 분리", len(far) == expected),
+        ("드문 비콘 이벤트 모두 수신", len(sparse) == SPARSE_EVENTS),
+    ]
+    failed = False
+    for name, ok in checks:
+        print(f"[{'OK' if ok else 'FAIL'}] {name}")
+        failed = failed or not ok
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+bench.py용 합성 캡처(adv_capture.json) 생성 스크립트.
+
+실제 녹화본이 아니라, nRF Sniffer + tshark -T json 출력 형식을 흉내 낸 합성 데이터입니다.
+- 프로필 대상 디바이스 2개(같은 UUID, 100ms 간격)와 다른 UUID 디바이스 1개(250ms 간격)
+- 임의 주소(xx:11:22:33:44:NN)의 잡음 패킷 30개 (ADV_IND/ADV_NONCONN_IND/ADV_SCAN_IND)
+- 광고 이벤트마다 37/38/39 채널로 0.6ms 간격 전송
+
+시드가 고정되어 있어 같은 파일이 다시 만들어집니다.
+사용법 (저장소 루트에서): python fixtures/make_adv_capture.py
+"""
+
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture import ADV_CHANNELS, transform_uuid  # noqa: E402
+
+OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "adv_capture.json")
+
+SEED = 7
+START_TIME = 1740000000.0  # 첫 패킷 기준 시각 (epoch 초)
+DURATION = 4.0  # 캡처 길이 (초)
+NOISE_PACKETS = 30
+CHANNEL_GAP = 0.0006  # 채널 간 전송 간격 (초)
+
+# (광고 주소, UUID, 광고 간격 초)
+DEVICES = [
+    ("72:cf:4d:7d:8e:58", "12345678-1234-1234-1234-1234567890ab", 0.100),
+    ("03:23:45:67:89:ab", "12345678-1234-1234-1234-1234567890ab", 0.100),
+    ("5c:31:92:aa:10:07", "e2c56db5-dffb-48d2-b060-d0f5a71096e0", 0.250),
+]
+
+
+def make_events():
+    """(시각, 광고 주소, UUID 또는 None, PDU 타입) 목록을 시간 순으로 생성"""
+    events = []
+    for address, uuid, interval in DEVICES:
+        # 광고 간격 + advDelay(0~10ms)
+        t = START_TIME + random.random() * interval
+        while t < START_TIME + DURATION:
+            events.append((t, address, uuid, "0x00"))
+            t += interval + random.random() * 0.010
+
+    for i in range(NOISE_PACKETS):
+        events.append(
+            (
+                START_TIME + random.random() * DURATION,
+                "%02x:11:22:33:44:%02x" % (random.randrange(256), i),
+                None,
+                random.choice(["0x00", "0x02", "0x03"]),
+            )
+        )
+    events.sort()
+    return events
+
+
+def make_packet(number, timestamp, channel, address, uuid, pdu_type):
+    """tshark -T json 패킷 객체 하나를 생성"""
+    data = {
+        "btcommon.eir_ad.entry": {
+            "btcommon.eir_ad.entry.length": "26",
+            "btcommon.eir_ad.entry.type": "0xff",
+            "btcommon.eir_ad.entry.company_id": "0x004c",
+            "btcommon.eir_ad.entry.data": transform_uuid(uuid) if uuid else "01:02:03",
+        }
+    }
+    return {
+        "_index": "packets-2025-02-19",
+        "_type": "doc",
+        "_score": None,
+        "_source": {
+            "layers": {
+                "frame": {
+                    "frame.encap_type": "186",
+                    "frame.time": "Feb 19, 2025 21:20:00.%06d000 KST"
+                    % int((timestamp % 1) * 1e6),
+                    "frame.time_epoch": "%.9f" % timestamp,
+                    "frame.number": str(number),
+                    "frame.len": "47",
+                    "frame.protocols": "nordic_ble:btle:btcommon",
+                },
+                "nordic_ble": {
+                    "nordic_ble.board_id": "0",
+                    "nordic_ble.channel": str(channel),
+                    "nordic_ble.rssi": str(-40 - random.randrange(30)),
+                    "nordic_ble.event_counter": "0x0000",
+                    "nordic_ble.delta_time": "%d" % random.randrange(100, 300),
+                },
+                "btle": {
+                    "btle.access_address": "0x8e89bed6",
+                    "btle.advertising_header": "0x2540",
+                    "btle.advertising_header_tree": {
+                        "btle.advertising_header.pdu_type": pdu_type,
+                        "btle.advertising_header.randomized_tx": "1",
+                        "btle.advertising_header.length": "37",
+                    },
+                    "btle.advertising_address": address,
+                    "btcommon.eir_ad.advertising_data": data,
+                    "btle.crc": "0x3fc2d1",
+                },
+            }
+        },
+    }
+
+
+def main():
+    random.seed(SEED)
+    packets = []
+    for timestamp, address, uuid, pdu_type in make_events():
+        for k, channel in enumerate(ADV_CHANNELS):
+            packets.append(
+                make_packet(
+                    len(packets) + 1,
+                    timestamp + k * CHANNEL_GAP,
+                    channel,
+                    address,
+                    uuid,
+                    pdu_type,
+                )
+            )
+
+    # tshark처럼 패킷 객체를 "\n,\n"으로 구분해 줄 단위로 출력
+    output = (
+        "[\n"
+        + "\n,\n".join(
+            "  " + json.dumps(packet, indent=2).replace("\n", "\n  ")
+            for packet in packets
+        )
+        + "\n]\n"
+    )
+    with open(OUTPUT, "w") as f:
+        f.write(output)
+    print(f"{OUTPUT}: {len(packets)}개 패킷, {len(output)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import threading
+import time
+from collections import deque
+
+from capture import DEFAULT_EVENT_WINDOW, EventCoalescer, PacketSource
+
+
+class LoadShedder:
+    """
+    과부하 시 광고 이벤트 처리 여부를 결정하는 정책.
+
+    - 캡처 지연(현재 시각 - 방금 읽은 패킷 시각) 또는 대기 큐 길이가 상한을 넘으면 과부하 모드로
+      들어가고, 둘 다 하한 아래로 내려오면 해제한다 (히스테리시스).
+    - 보호 디바이스(프로필 저장/감시 목록)의 이벤트는 항상 처리한다.
+    - 과부하 중에는 그 밖의 디바이스 이벤트를 버리거나 sample_rate개 중 1개만 처리한다.
+    """
+
+    def __init__(
+        self,
+        load_protected,
+        lag_high=2.0,
+        lag_low=0.5,
+        queue_high=5000,
+        queue_low=500,
+        sample_rate=0,
+        refresh_interval=60,
+        report_interval=10,
+    ):
+        """
+        :param load_protected: (주소 집합, 페이로드 집합)을 반환하는 함수
+        :param lag_high: 과부하 진입 캡처 지연 (초, None이면 지연 검사 안 함)
+        :param lag_low: 과부하 해제 캡처 지연 (초)
+        :param queue_high: 과부하 진입 큐 길이
+        :param queue_low: 과부하 해제 큐 길이
+        :param sample_rate: 과부하 시 비보호 이벤트 N개 중 1개만 처리 (0이면 모두 버림)
+        :param refresh_interval: 보호 디바이스 목록 갱신 주기 (초)
+        :param report_interval: 과부하 중 상태 출력 주기 (초)
+        """
+        self.load_protected = load_protected
+        self.lag_high = lag_high
+        self.lag_low = lag_low
+        self.queue_high = queue_high
+        self.queue_low = queue_low
+        self.sample_rate = sample_rate
+        self.refresh_interval = refresh_interval
+        self.report_interval = report_interval
+
+        self.overloaded = False
+        self.counts = {"protected": 0, "admitted": 0, "sampled": 0, "shed": 0}
+        self._addresses = set()
+        self._payloads = set()
+        self._last_refresh = None
+        self._last_report = 0.0
+        self._unprotected_seen = 0
+
+    def refresh(self, now):
+        """주기적으로 보호 디바이스 목록을 다시 읽음"""
+        if (
+            self._last_refresh is not None
+            and now - self._last_refresh < self.refresh_interval
+        ):
+            return
+        self._last_refresh = now
+        try:
+            self._addresses, self._payloads = self.load_protected()
+        except Exception as e:
+            print(f"[과부하] 보호 디바이스 목록 갱신 실패: {e}")
+
+    def is_protected(self, event):
+        """광고 주소나 광고 데이터(UUID)가 보호 목록에 있는지 (BlePacket/AdvEvent 모두 가능)"""
+        return event.address in self._addresses or event.payload in self._payloads
+
+    def update(self, lag, depth, now):
+        """캡처 지연과 큐 길이로 과부하 상태를 갱신"""
+        lag_over = self.lag_high is not None and lag > self.lag_high
+        lag_under = self.lag_high is None or lag < self.lag_low
+
+        if not self.overloaded and (lag_over or depth > self.queue_high):
+            print(f"[과부하] 진입: 캡처 지연 {lag:.2f}s, 대기 큐 {depth}")
+            self._last_report = now
+            self.overloaded = True
+        elif self.overloaded and lag_under and depth < self.queue_low:
+            self.overloaded = False
+            print(f"[과부하] 해제: 캡처 지연 {lag:.2f}s, 대기 큐 {depth}")
+            self.report(now, force=True)
+
+    def admit(self, protected):
+        """이벤트를 처리할지 결정하고 카운트를 갱신"""
+        if protected:
+            self.counts["protected"] += 1
+            return True
+        if not self.overloaded:
+            self.counts["admitted"] += 1
+            return True
+
+        self._unprotected_seen += 1
+        if self.sample_rate and self._unprotected_seen % self.sample_rate == 0:
+            self.counts["sampled"] += 1
+            return True
+        self.counts["shed"] += 1
+        return False
+
+    def report(self, now, force=False):
+        """과부하 중이면 report_interval마다 처리/버림 통계를 출력"""
+        if not force and (
+            not self.overloaded or now - self._last_report < self.report_interval
+        ):
+            return
+        self._last_report = now
+        counts = self.counts
+        print(
+            f"[과부하] 보호 처리 {counts['protected']}, 일반 처리 {counts['admitted']}, "
+            f"샘플 처리 {counts['sampled']}, 버림 {counts['shed']}"
+        )
+
+
+class SheddingSource(PacketSource):
+    """
+    다른 패킷 소스를 별도 스레드에서 읽어 광고 이벤트로 묶고, LoadShedder로
+    이벤트 단위로 거르는 소스. 패킷이 아니라 AdvEvent를 내보냅니다.
+
+    - 필터링, on_packet 호출, 이벤트 묶기는 읽기 스레드에서 캡처 순서대로 한다.
+    - 캡처 지연은 읽기 스레드가 방금 읽은 패킷 기준으로 잰다 (이벤트 묶기 대기 제외).
+    - 새 패킷이 idle_flush(초) 동안 없으면 채널 사본을 놓친 이벤트도 내보낸다.
+    - 보호 디바이스 이벤트는 우선 큐에 넣어 일반 이벤트보다 먼저 내보낸다.
+      한 디바이스의 이벤트는 항상 같은 큐로 가므로 디바이스별 시간 순서는 유지된다.
+    """
+
+    def __init__(
+        self,
+        source,
+        shedder,
+        matches=None,
+        event_window=DEFAULT_EVENT_WINDOW,
+        on_packet=None,
+        idle_flush=0.25,
+    ):
+        """
+        :param source: 원본 패킷 소스
+        :param shedder: LoadShedder
+        :param matches: (선택) 이벤트로 묶기 전에 적용할 패킷 필터 함수
+        :param event_window: 한 광고 이벤트로 묶을 최대 시간 폭 (초)
+        :param on_packet: (선택) 필터를 통과한 패킷마다 캡처 순서대로 호출할 함수
+                          (예: 저장소 기록). 과부하와 관계없이 모든 패킷에 호출된다.
+        :param idle_flush: 새 패킷이 없을 때 묶는 중인 이벤트를 내보내기까지 기다릴 시간 (초)
+        """
+        self.source = source
+        self.shedder = shedder
+        self.matches = matches
+        self.on_packet = on_packet
+        self.idle_flush = idle_flush
+
+        self._coalescer = EventCoalescer(event_window)
+        self._lock = threading.Lock()  # 이벤트 묶기/과부하 정책 (읽기 스레드와 유휴 처리)
+        self._priority = deque()
+        self._bulk = deque()
+        self._cond = threading.Condition()
+        self._done = False
+        self._thread = None
+
+    def _read(self):
+        shedder = self.shedder
+        try:
+            for packet in self.source:
+                now = time.time()
+                shedder.refresh(now)
+                with self._cond:
+                    depth = len(self._priority) + len(self._bulk)
+
+                with self._lock:
+                    shedder.update(now - packet.timestamp, depth, now)
+                    if self.matches is not None and not self.matches(packet):
+                        events = self._coalescer.advance(packet.timestamp)
+                    else:
+                        if self.on_packet is not None:
+                            self.on_packet(packet)
+                        events = self._coalescer.add(packet)
+                    self._admit(events)
+
+            with self._lock:
+                self._admit(self._coalescer.flush())
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify()
+
+    def _admit(self, events):
+        for event in events:
+            protected = self.shedder.is_protected(event)
+            if not self.shedder.admit(protected):
+                continue
+            with self._cond:
+                (self._priority if protected else self._bulk).append(event)
+                self._cond.notify()
+
+    def _expire_idle(self):
+        with self._lock:
+            self._admit(self._coalescer.expire_idle(time.time() - self.idle_flush))
+
+    def __iter__(self):
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+        while True:
+            with self._cond:
+                if not (self._priority or self._bulk or self._done):
+                    self._cond.wait(self.idle_flush)
+                if self._priority:
+                    event = self._priority.popleft()
+                elif self._bulk:
+                    event = self._bulk.popleft()
+                elif self._done:
+                    break
+                else:
+                    event = None
+
+            if event is None:
+                # 대기 중에 새 이벤트가 없으면 채널 사본을 놓친 이벤트를 내보냄
+                self._expire_idle()
+                continue
+            self.shedder.report(time.time())
+            yield event
+
+    def close(self):
+        self.source.close()
+        # 읽기 스레드가 on_packet(저장소 기록)을 마칠 때까지 대기
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.shedder.report(time.time(), force=True)
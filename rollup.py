@@ -0,0 +1,369 @@
+import math
+import sys
+import time
+from datetime import datetime
+
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# 롤업 버킷 (이름 -> 길이 초)
+DEFAULT_BUCKETS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+# 롤업하는 값 (광고 이벤트 간격, RSSI)
+FIELDS = ("interval", "rssi")
+
+
+def _new_stats():
+    return {"count": 0, "sum": 0.0, "sumsq": 0.0, "min": math.inf, "max": -math.inf}
+
+
+def _add(stats, value):
+    stats["count"] += 1
+    stats["sum"] += value
+    stats["sumsq"] += value * value
+    if value < stats["min"]:
+        stats["min"] = value
+    if value > stats["max"]:
+        stats["max"] = value
+
+
+def _merge(stats, other):
+    """다른 누적값을 stats에 합침"""
+    stats["count"] += other["count"]
+    stats["sum"] += other["sum"]
+    stats["sumsq"] += other["sumsq"]
+    stats["min"] = min(stats["min"], other["min"])
+    stats["max"] = max(stats["max"], other["max"])
+
+
+def summarize(stats):
+    """누적값(count/sum/sumsq/min/max)으로 평균과 표준편차를 계산"""
+    count = stats.get("count", 0)
+    if not count:
+        return {"count": 0, "mean": None, "stdev": None, "min": None, "max": None}
+    mean = stats["sum"] / count
+    stdev = None
+    if count > 1:
+        stdev = math.sqrt(max(0.0, (stats["sumsq"] - stats["sum"] * mean) / (count - 1)))
+    return {
+        "count": count,
+        "mean": mean,
+        "stdev": stdev,
+        "min": stats["min"],
+        "max": stats["max"],
+    }
+
+
+def load_baselines(profiles):
+    """
+    프로필 컬렉션에서 디바이스별 기준값을 읽습니다.
+    :return: {디바이스 ID: {"interval": 평균 광고 간격 또는 None, "rssi": 평균 RSSI 또는 None}}
+    """
+    baselines = {}
+    for entry in profiles.find(
+        {},
+        {"_id": 0, "uuid": 1, "advertising_address": 1, "avg_advertising_interval": 1, "rssi": 1},
+    ):
+        baseline = {
+            "interval": entry.get("avg_advertising_interval"),
+            "rssi": entry.get("rssi"),
+        }
+        for key in ("uuid", "advertising_address"):
+            if entry.get(key):
+                baselines[entry[key]] = baseline
+    return baselines
+
+
+class IntervalRollup:
+    """
+    디바이스별 광고 간격/RSSI 롤업.
+
+    - 이벤트마다 버킷별 누적값(count/sum/sumsq/min/max)을 메모리에서 갱신하고,
+      flush_interval마다 $inc/$min/$max upsert로 MongoDB에 한 번에 기록한다.
+    - drift_bucket이 끝날 때마다 그 버킷의 평균을 프로필 기준값과 비교해,
+      허용 범위를 넘으면 재프로파일링 요청을 기록한다.
+    """
+
+    def __init__(
+        self,
+        rollups,
+        reprofile=None,
+        profiles=None,
+        buckets=DEFAULT_BUCKETS,
+        flush_interval=10,
+        drift_bucket="1h",
+        drift_min_samples=100,
+        interval_drift_limit=0.10,
+        rssi_drift_limit=10.0,
+        baseline_refresh=600,
+        client=None,
+    ):
+        """
+        :param rollups: 롤업 문서를 저장할 컬렉션
+        :param reprofile: 재프로파일링 요청을 기록할 컬렉션 (None이면 드리프트 검사 안 함)
+        :param profiles: 프로필(uuid_analysis_results) 컬렉션
+        :param buckets: 버킷 이름 -> 길이(초)
+        :param flush_interval: MongoDB 기록 주기 (초)
+        :param drift_bucket: 드리프트를 검사할 버킷 이름
+        :param drift_min_samples: 드리프트 검사에 필요한 최소 간격 수
+        :param interval_drift_limit: 허용 평균 간격 변화율 (0.10 = 10%)
+        :param rssi_drift_limit: 허용 평균 RSSI 변화 (dB)
+        :param baseline_refresh: 프로필 기준값 갱신 주기 (초)
+        :param client: (선택) close() 시 함께 닫을 MongoClient
+        """
+        self.rollups = rollups
+        self.reprofile = reprofile
+        self.profiles = profiles
+        self.buckets = buckets
+        self.flush_interval = flush_interval
+        self.drift_bucket = drift_bucket
+        self.drift_min_samples = drift_min_samples
+        self.interval_drift_limit = interval_drift_limit
+        self.rssi_drift_limit = rssi_drift_limit
+        self.baseline_refresh = baseline_refresh
+        self.client = client
+
+        self._pending = {}  # (디바이스, 버킷, 시작 시각) -> {필드: 누적값}
+        self._current = {}  # 디바이스 -> [drift_bucket 시작 시각, {필드: 누적값}]
+        self._last_flush = time.time()
+        self._baselines = {}
+        self._last_baseline = None
+        self._indexed = False
+
+    def add(self, device_id, timestamp, interval, rssi=None):
+        """
+        광고 이벤트 하나를 롤업에 반영합니다.
+        :param device_id: 디바이스 ID (광고 주소 또는 UUID)
+        :param timestamp: 이벤트 시각 (epoch 초)
+        :param interval: 직전 이벤트와의 간격 (초)
+        :param rssi: 이벤트 RSSI (없으면 None)
+        """
+        values = (("interval", interval), ("rssi", rssi))
+        for name, length in self.buckets.items():
+            start = timestamp - timestamp % length
+            key = (device_id, name, start)
+            stats = self._pending.get(key)
+            if stats is None:
+                stats = self._pending[key] = {field: _new_stats() for field in FIELDS}
+            for field, value in values:
+                if value is not None:
+                    _add(stats[field], value)
+
+        if self.reprofile is not None and self.drift_bucket in self.buckets:
+            self._track_drift(device_id, timestamp, values)
+
+        if time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """메모리의 누적값을 MongoDB에 upsert로 기록"""
+        self._last_flush = time.time()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+
+        operations = []
+        keys = []  # operations와 같은 순서의 pending 키
+        for (device_id, name, start), stats in pending.items():
+            inc, low, high = {}, {}, {}
+            for field, values in stats.items():
+                if not values["count"]:
+                    continue
+                inc[f"{field}.count"] = values["count"]
+                inc[f"{field}.sum"] = values["sum"]
+                inc[f"{field}.sumsq"] = values["sumsq"]
+                low[f"{field}.min"] = values["min"]
+                high[f"{field}.max"] = values["max"]
+            if not inc:
+                continue
+            keys.append((device_id, name, start))
+            operations.append(
+                UpdateOne(
+                    {"device": device_id, "bucket": name, "start": start},
+                    {"$inc": inc, "$min": low, "$max": high},
+                    upsert=True,
+                )
+            )
+
+        if not operations:
+            return
+        try:
+            self._ensure_index()
+            self.rollups.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # 일부만 실패: 실패한 문서의 누적값만 다음 flush에서 다시 기록
+            failed = [keys[error["index"]] for error in e.details.get("writeErrors", [])]
+            print(f"롤업 저장 오류 ({len(failed)}개 문서, 다음 기록 때 재시도): {e}")
+            self._requeue({key: pending[key] for key in failed})
+        except Exception as e:
+            # 기록하지 못한 누적값은 다음 flush에서 다시 기록
+            print(f"롤업 저장 오류 (다음 기록 때 재시도): {e}")
+            self._requeue(pending)
+
+    def _requeue(self, pending):
+        """기록하지 못한 누적값을 그 사이 새로 쌓인 값과 합쳐 대기열에 되돌림"""
+        for key, stats in pending.items():
+            current = self._pending.get(key)
+            if current is None:
+                self._pending[key] = stats
+                continue
+            for field, values in stats.items():
+                _merge(current[field], values)
+
+    def close(self):
+        self.flush()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def _ensure_index(self):
+        # 시작 시 MongoDB에 연결할 수 없어도 탐지가 멈추지 않도록 첫 기록 때 생성
+        if self._indexed:
+            return
+        self.rollups.create_index(
+            [("device", ASCENDING), ("bucket", ASCENDING), ("start", ASCENDING)],
+            unique=True,
+        )
+        self._indexed = True
+
+    def _track_drift(self, device_id, timestamp, values):
+        length = self.buckets[self.drift_bucket]
+        start = timestamp - timestamp % length
+        current = self._current.get(device_id)
+        if current is not None and current[0] != start:
+            self._check_drift(device_id, current[0], current[1])
+            current = None
+        if current is None:
+            current = self._current[device_id] = [
+                start,
+                {field: _new_stats() for field in FIELDS},
+            ]
+        for field, value in values:
+            if value is not None:
+                _add(current[1][field], value)
+
+    def _baseline(self, device_id):
+        now = time.time()
+        if self.profiles is not None and (
+            self._last_baseline is None
+            or now - self._last_baseline >= self.baseline_refresh
+        ):
+            self._last_baseline = now
+            try:
+                self._baselines = load_baselines(self.profiles)
+            except Exception as e:
+                print(f"프로필 기준값 조회 오류: {e}")
+        return self._baselines.get(device_id)
+
+    def _check_drift(self, device_id, start, stats):
+        """끝난 drift_bucket의 평균을 프로필 기준값과 비교"""
+        interval = summarize(stats["interval"])
+        if interval["count"] < self.drift_min_samples:
+            return
+        baseline = self._baseline(device_id)
+        if baseline is None:
+            return
+        rssi = summarize(stats["rssi"])
+
+        reasons = []
+        if baseline["interval"]:
+            change = interval["mean"] / baseline["interval"] - 1
+            if abs(change) > self.interval_drift_limit:
+                reasons.append(
+                    f"평균 간격 {interval['mean']:.6f}s (기준 {baseline['interval']:.6f}s, {change:+.1%})"
+                )
+        if baseline["rssi"] is not None and rssi["count"]:
+            change = rssi["mean"] - baseline["rssi"]
+            if abs(change) > self.rssi_drift_limit:
+                reasons.append(
+                    f"평균 RSSI {rssi['mean']:.1f} (기준 {baseline['rssi']:.1f}, {change:+.1f}dB)"
+                )
+        if not reasons:
+            return
+
+        print(f"[!] 드리프트 감지, 재프로파일링 필요 ({device_id}): " + ", ".join(reasons))
+        try:
+            self.reprofile.update_one(
+                {"device": device_id},
+                {
+                    "$set": {
+                        "bucket": self.drift_bucket,
+                        "start": start,
+                        "interval": interval,
+                        "rssi": rssi,
+                        "baseline": baseline,
+                        "reasons": reasons,
+                        "flagged_at": time.time(),
+                    }
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"재프로파일링 요청 저장 오류: {e}")
+
+
+def query_trend(rollups, device_id, bucket="1h", start=None, end=None):
+    """
+    디바이스의 버킷별 롤업을 시간 순으로 조회합니다.
+    :return: [{"start", "interval": summarize(...), "rssi": summarize(...)}] 리스트
+    """
+    query = {"device": device_id, "bucket": bucket}
+    if start is not None or end is not None:
+        query["start"] = {}
+        if start is not None:
+            query["start"]["$gte"] = start
+        if end is not None:
+            query["start"]["$lte"] = end
+
+    return [
+        {
+            "start": document["start"],
+            "interval": summarize(document.get("interval", {})),
+            "rssi": summarize(document.get("rssi", {})),
+        }
+        for document in rollups.find(query, {"_id": 0}).sort("start", ASCENDING)
+    ]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("사용법: python rollup.py <디바이스 ID> [버킷(1m/1h/1d)] [조회 기간(시간)]")
+        print("예시: python rollup.py 72:cf:4d:7d:8e:58 1d 720")
+        sys.exit(1)
+
+    from tabulate import tabulate
+
+    from detect import DB_NAME, MONGO_URI, ROLLUP_CONFIG
+
+    device_id = sys.argv[1]
+    bucket = sys.argv[2] if len(sys.argv) > 2 else "1h"
+    hours = float(sys.argv[3]) if len(sys.argv) > 3 else 24 * 7
+
+    client = MongoClient(MONGO_URI)
+    try:
+        rollups = client[DB_NAME][ROLLUP_CONFIG["collection"]]
+        trend = query_trend(rollups, device_id, bucket, start=time.time() - hours * 3600)
+    finally:
+        client.close()
+
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    table_data = [
+        [
+            datetime.fromtimestamp(row["start"]).strftime("%Y-%m-%d %H:%M"),
+            row["interval"]["count"],
+            fmt(row["interval"]["mean"], ".6f"),
+            fmt(row["interval"]["stdev"], ".6f"),
+            fmt(row["interval"]["min"], ".6f"),
+            fmt(row["rssi"]["mean"], ".1f"),
+            fmt(row["rssi"]["stdev"], ".1f"),
+        ]
+        for row in trend
+    ]
+    headers = ["버킷 시작", "간격 수", "간격 평균 (s)", "간격 표준편차 (s)", "최소 간격 (s)", "RSSI 평균", "RSSI 표준편차"]
+    print(tabulate(table_data, headers=headers, tablefmt="fancy_grid"))
+
+
+if __name__ == "__main__":
+    main()
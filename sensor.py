@@ -0,0 +1,402 @@
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from capture import (
+    DEFAULT_EVENT_WINDOW,
+    AdvEvent,
+    EventCoalescer,
+    FileSource,
+    ReplaySource,
+    TsharkSource,
+    build_packet_filter,
+    find_interface,
+)
+
+# 전송 설정
+SENSOR_CONFIG = {
+    "batch_interval": 0.5,  # 배치 전송 주기 (초)
+    "batch_size": 500,  # 배치 최대 이벤트 수
+    "reconnect_interval": 5.0,  # 연결 실패 시 재시도 간격 (초)
+    "idle_flush": 0.25,  # 새 패킷이 없을 때 묶는 중인 이벤트를 내보내기까지 기다릴 시간 (초)
+}
+
+# 배치 프레임 형식 (빅 엔디언)
+#   프레임: [본문 길이 u32][zlib 압축 본문]
+#   본문:   헤더 + 이벤트 레코드 count개
+#   헤더:   버전 u8, 센서 ID 16바이트 (UTF-8, 남는 자리는 0), 전송 시각 f64, 기준 시각 f64, 이벤트 수 u16
+#   이벤트: 주소 6바이트, PDU 타입 u8, 기준 시각 대비 오프셋(µs) u32, 채널 수 u8,
+#           채널별 [채널 u8, RSSI i8, 첫 패킷 대비 오프셋(10µs) u16],
+#           광고 데이터 길이 u8 + 광고 데이터
+WIRE_VERSION = 1
+FRAME = struct.Struct(">I")
+HEADER = struct.Struct(">B16sddH")
+EVENT = struct.Struct(">6sBIB")
+CHANNEL = struct.Struct(">BbH")
+
+MISSING_U1 = 0xFF
+MISSING_RSSI = -128
+
+SENSOR_ID_SIZE = 16  # 센서 ID 최대 길이 (UTF-8 바이트)
+MAX_BATCH_EVENTS = 0xFFFF  # 헤더 이벤트 수(u16) 상한
+
+
+def max_event_delay(batch_interval, idle_flush, window=DEFAULT_EVENT_WINDOW):
+    """
+    이벤트 첫 패킷 이후 애그리게이터로 전송되기까지의 최대 지연 (초, 네트워크 지연 제외).
+    채널 사본을 놓친 이벤트는 window + idle_flush 두 번(대기 + 검사 주기)까지 묶는 중으로
+    남고, 그 뒤 최대 batch_interval 동안 배치에 모인다.
+    """
+    return window + 2 * idle_flush + batch_interval
+
+
+def check_sensor_id(sensor_id):
+    """센서 ID가 헤더에 잘리지 않고 들어가는지 검사 (UTF-8 16바이트 이하)"""
+    size = len(sensor_id.encode("utf-8"))
+    if not sensor_id or size > SENSOR_ID_SIZE:
+        raise ValueError(
+            f"센서 ID는 UTF-8 1~{SENSOR_ID_SIZE}바이트여야 합니다: {sensor_id!r} ({size}바이트)"
+        )
+
+
+def encode_batch(sensor_id, events, send_time=None):
+    """
+    AdvEvent 목록을 압축된 전송 프레임으로 변환합니다.
+    주소를 6바이트로 변환할 수 없는 이벤트는 건너뜁니다.
+    센서 ID가 16바이트를 넘거나 이벤트가 MAX_BATCH_EVENTS개를 넘으면 ValueError.
+    """
+    check_sensor_id(sensor_id)
+    send_time = time.time() if send_time is None else send_time
+    base_time = min((event.timestamp for event in events), default=send_time)
+
+    records = []
+    for event in events:
+        try:
+            address = bytes.fromhex(event.address.replace(":", ""))
+        except (AttributeError, ValueError):
+            continue
+        if len(address) != 6:
+            continue
+
+        parts = [
+            EVENT.pack(
+                address,
+                MISSING_U1 if event.pdu_type is None else event.pdu_type,
+                max(0, min(0xFFFFFFFF, int((event.timestamp - base_time) * 1e6))),
+                len(event.channels),
+            )
+        ]
+        for channel, timestamp, rssi in zip(event.channels, event.timestamps, event.rssi):
+            parts.append(
+                CHANNEL.pack(
+                    0 if channel is None else channel,
+                    MISSING_RSSI if rssi is None else max(-127, min(127, int(rssi))),
+                    max(0, min(0xFFFF, int((timestamp - event.timestamp) * 1e5))),
+                )
+            )
+        payload = event.payload[:0xFF]
+        parts.append(bytes((len(payload),)) + payload)
+        records.append(b"".join(parts))
+
+    if len(records) > MAX_BATCH_EVENTS:
+        raise ValueError(f"배치 이벤트 수 초과: {len(records)} > {MAX_BATCH_EVENTS}")
+    header = HEADER.pack(
+        WIRE_VERSION,
+        sensor_id.encode("utf-8"),
+        send_time,
+        base_time,
+        len(records),
+    )
+    body = zlib.compress(header + b"".join(records))
+    return FRAME.pack(len(body)) + body
+
+
+def decode_batch(body):
+    """
+    encode_batch로 만든 프레임 본문(길이 제외)을 해석합니다.
+    :return: (센서 ID, 전송 시각, AdvEvent 리스트)
+    """
+    data = zlib.decompress(body)
+    version, sensor_id, send_time, base_time, count = HEADER.unpack_from(data, 0)
+    if version != WIRE_VERSION:
+        raise ValueError(f"지원하지 않는 프레임 버전: {version}")
+    sensor_id = sensor_id.rstrip(b"\x00").decode("utf-8")
+
+    offset = HEADER.size
+    events = []
+    for _ in range(count):
+        address, pdu_type, ts_offset, num_channels = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+        timestamp = base_time + ts_offset / 1e6
+
+        channels, timestamps, rssi = [], [], []
+        for _ in range(num_channels):
+            channel, channel_rssi, dt = CHANNEL.unpack_from(data, offset)
+            offset += CHANNEL.size
+            channels.append(channel or None)
+            timestamps.append(timestamp + dt / 1e5)
+            rssi.append(None if channel_rssi == MISSING_RSSI else float(channel_rssi))
+
+        payload_len = data[offset]
+        payload = data[offset + 1 : offset + 1 + payload_len]
+        offset += 1 + payload_len
+
+        events.append(
+            AdvEvent(
+                address.hex(":"),
+                None if pdu_type == MISSING_U1 else pdu_type,
+                timestamp,
+                tuple(channels),
+                tuple(timestamps),
+                tuple(rssi),
+                payload,
+            )
+        )
+    return sensor_id, send_time, events
+
+
+def recv_frame(sock):
+    """소켓에서 프레임 하나를 읽어 본문을 반환 (연결이 끊기면 None)"""
+    header = _recv_exact(sock, FRAME.size)
+    if header is None:
+        return None
+    return _recv_exact(sock, FRAME.unpack(header)[0])
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class SensorClient:
+    """
+    광고 이벤트를 모아 batch_interval마다 애그리게이터로 전송하는 클라이언트.
+    연결이 끊기면 reconnect_interval마다 다시 연결하며, 그동안의 배치는 버립니다.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        sensor_id,
+        batch_interval=0.5,
+        batch_size=500,
+        reconnect_interval=5.0,
+        clock=time.time,
+    ):
+        """
+        :param clock: 배치 전송 시각에 쓸 시계 함수 (로컬 시험에서 센서 시계 오차 재현용)
+        """
+        check_sensor_id(sensor_id)
+        if not 1 <= batch_size <= MAX_BATCH_EVENTS:
+            raise ValueError(f"batch_size는 1~{MAX_BATCH_EVENTS} 사이여야 합니다: {batch_size}")
+
+        self.host = host
+        self.port = port
+        self.sensor_id = sensor_id
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        self.reconnect_interval = reconnect_interval
+        self.clock = clock
+
+        self.counts = {"events": 0, "batches": 0, "bytes": 0, "dropped": 0}
+        self._events = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._sock = None
+        self._last_connect = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def send(self, event):
+        """이벤트 한 개를 배치에 추가 (배치가 차면 즉시 전송)"""
+        with self._lock:
+            self._events.append(event)
+            full = len(self._events) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """모인 이벤트를 프레임 하나로 전송"""
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return
+
+        try:
+            frame = encode_batch(self.sensor_id, events, self.clock())
+        except (struct.error, ValueError) as e:
+            print(f"배치 인코딩 실패 ({len(events)}개 이벤트 버림): {e}")
+            self.counts["dropped"] += len(events)
+            return
+
+        with self._send_lock:  # 전송 스레드와 send()가 동시에 보내지 않도록
+            sock = self._connect()
+            try:
+                if sock is None:
+                    raise OSError("애그리게이터에 연결되지 않음")
+                sock.sendall(frame)
+            except OSError as e:
+                print(f"배치 전송 실패 ({len(events)}개 이벤트 버림): {e}")
+                self.counts["dropped"] += len(events)
+                self._disconnect()
+                return
+
+            self.counts["events"] += len(events)
+            self.counts["batches"] += 1
+            self.counts["bytes"] += len(frame)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        self._disconnect()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.batch_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # 전송 스레드가 죽으면 이후 배치가 조용히 쌓이기만 하므로 계속 진행
+                print(f"배치 전송 오류: {e}")
+
+    def _connect(self):
+        if self._sock is not None:
+            return self._sock
+        now = time.time()
+        if (
+            self._last_connect is not None
+            and now - self._last_connect < self.reconnect_interval
+        ):
+            return None
+        self._last_connect = now
+        try:
+            self._sock = socket.create_connection((self.host, self.port), timeout=5)
+            print(f"애그리게이터 연결 성공: {self.host}:{self.port}")
+        except OSError as e:
+            print(f"애그리게이터 연결 실패: {e}")
+            self._sock = None
+        return self._sock
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def run_sensor(client, source, target_addr, target_uuid, idle_flush=0.25):
+    """
+    캡처한 패킷을 필터링하고 광고 이벤트로 묶어 애그리게이터로 전송.
+    새 패킷이 idle_flush(초) 동안 없으면 채널 사본을 놓친 이벤트도 내보냅니다.
+    """
+    matches = build_packet_filter(target_addr, target_uuid)
+    coalescer = EventCoalescer()
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def idle_loop():
+        while not stop.wait(idle_flush):
+            with lock:
+                events = coalescer.expire_idle(time.time() - idle_flush)
+            for event in events:
+                client.send(event)
+
+    idle_thread = threading.Thread(target=idle_loop, daemon=True)
+    idle_thread.start()
+    try:
+        for packet in source:
+            with lock:
+                if matches(packet):
+                    events = coalescer.add(packet)
+                else:
+                    events = coalescer.advance(packet.timestamp)
+            for event in events:
+                client.send(event)
+        stop.set()
+        idle_thread.join()
+        for event in coalescer.flush():
+            client.send(event)
+    finally:
+        stop.set()
+        source.close()
+        client.close()
+        counts = client.counts
+        print(
+            f"전송 이벤트 {counts['events']}, 배치 {counts['batches']}, "
+            f"전송량 {counts['bytes']} bytes, 버린 이벤트 {counts['dropped']}"
+        )
+
+
+def open_source(capture):
+    """
+    센서 캡처 소스를 엽니다.
+    :param capture: 인터페이스 이름, tshark -T json 파일 경로(실시간 재생) 또는 None(자동 탐색)
+    :return: PacketSource (인터페이스를 찾지 못하면 None)
+    """
+    if capture and os.path.isfile(capture):
+        print(f"캡처 파일 재생: {capture}")
+        return ReplaySource(FileSource(capture))
+    interface = capture or find_interface()
+    if not interface:
+        return None
+    return TsharkSource(interface)
+
+
+def main():
+    if len(sys.argv) < 5:
+        print(
+            "사용법: python sensor.py <애그리게이터 host:port> <센서 ID> <target_address/all> <target_uuid/all> [인터페이스 또는 재생할 캡처 파일]"
+        )
+        print("예시: python sensor.py 192.168.0.10:7000 floor1-east all all")
+        print("예시: python sensor.py 127.0.0.1:7000 floor1-west all all fixtures/adv_capture.json")
+        sys.exit(1)
+
+    host, port = sys.argv[1].rsplit(":", 1)
+    sensor_id = sys.argv[2]
+    target_addr = sys.argv[3]
+    target_uuid = sys.argv[4].lower()
+    try:
+        check_sensor_id(sensor_id)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    source = open_source(sys.argv[5] if len(sys.argv) > 5 else None)
+    if source is None:
+        print("nRF Sniffer 인터페이스를 찾을 수 없습니다.")
+        sys.exit(1)
+
+    client = SensorClient(
+        host,
+        int(port),
+        sensor_id,
+        batch_interval=SENSOR_CONFIG["batch_interval"],
+        batch_size=SENSOR_CONFIG["batch_size"],
+        reconnect_interval=SENSOR_CONFIG["reconnect_interval"],
+    )
+    print(f"센서 모드 시작 (센서 ID: {sensor_id}, 애그리게이터: {host}:{port})")
+    try:
+        run_sensor(
+            client,
+            source,
+            target_addr,
+            target_uuid,
+            idle_flush=SENSOR_CONFIG["idle_flush"],
+        )
+    except KeyboardInterrupt:
+        print("\n센서 종료.")
+
+
+if __name__ == "__main__":
+    main()
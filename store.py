@@ -0,0 +1,352 @@
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from capture import BlePacket
+
+# 최대 광고 데이터 길이 (BLE 4.x 레거시 광고)
+PAYLOAD_SIZE = 31
+
+# 컬럼별 고정 폭 타입
+COLUMNS = {
+    "timestamp": np.dtype("<f8"),
+    "device": np.dtype("<u4"),
+    "channel": np.dtype("u1"),
+    "pdu_type": np.dtype("u1"),
+    "rssi": np.dtype("i1"),
+    "payload_len": np.dtype("u1"),
+    "payload": np.dtype((np.uint8, PAYLOAD_SIZE)),
+}
+
+# 값이 없을 때 사용하는 값 (channel/pdu_type/rssi)
+MISSING_U1 = 0xFF
+MISSING_RSSI = -128
+
+META_FILE = "meta.json"
+ACTIVE_DEVICES_FILE = "devices.json"
+
+
+def _encode(packet, device_code):
+    """BlePacket을 컬럼 값 튜플로 변환"""
+    payload = packet.payload[:PAYLOAD_SIZE]
+    return (
+        packet.timestamp,
+        device_code,
+        MISSING_U1 if packet.channel is None else packet.channel,
+        MISSING_U1 if packet.pdu_type is None else packet.pdu_type,
+        MISSING_RSSI if packet.rssi is None else max(-127, min(127, int(packet.rssi))),
+        len(payload),
+        np.frombuffer(payload.ljust(PAYLOAD_SIZE, b"\x00"), np.uint8),
+    )
+
+
+def _decode(address, columns, i):
+    """컬럼 배열의 i번째 행을 BlePacket으로 변환"""
+    channel = int(columns["channel"][i])
+    pdu_type = int(columns["pdu_type"][i])
+    rssi = int(columns["rssi"][i])
+    return BlePacket(
+        address,
+        None if channel == MISSING_U1 else channel,
+        None if pdu_type == MISSING_U1 else pdu_type,
+        float(columns["timestamp"][i]),
+        None if rssi == MISSING_RSSI else float(rssi),
+        bytes(columns["payload"][i][: columns["payload_len"][i]]),
+    )
+
+
+class CaptureStore:
+    """
+    매칭된 광고 패킷을 디스크에 남기는 롤링 컬럼 저장소.
+
+    - 세그먼트: segment_seconds 단위로 회전하는 디렉터리. 활성 세그먼트는 컬럼별
+      .bin 파일에 배치 단위로 append만 한다.
+    - 회전 시 세그먼트를 (디바이스, 시간) 순으로 정렬해 컬럼별 .npy로 확정하고,
+      meta.json에 디바이스별 [시작, 끝) 행 범위 인덱스를 기록한다.
+    - retention_segments를 넘는 오래된 세그먼트는 삭제한다.
+
+    readonly=True로 열면 조회만 하며, 다른 프로세스가 쓰고 있는 활성 세그먼트는
+    건드리지 않는다.
+    """
+
+    def __init__(
+        self,
+        path,
+        segment_seconds=3600,
+        retention_segments=24,
+        batch_size=256,
+        readonly=False,
+    ):
+        self.path = path
+        self.segment_seconds = segment_seconds
+        self.retention_segments = retention_segments
+        self.batch_size = batch_size
+
+        self._segment_start = None
+        self._segment_dir = None
+        self._devices = {}  # 활성 세그먼트: 주소 -> 디바이스 코드
+        self._pending = []  # 아직 기록하지 않은 행
+
+        if not readonly:
+            os.makedirs(self.path, exist_ok=True)
+            self._finalize_orphans()
+
+    # ---------------------------------------------------------------- 쓰기
+
+    def append(self, packet):
+        """패킷 한 개 추가 (배치가 차면 디스크에 기록)"""
+        if (
+            self._segment_start is None
+            or packet.timestamp >= self._segment_start + self.segment_seconds
+        ):
+            self._rotate(packet.timestamp)
+
+        device_code = self._devices.get(packet.address)
+        if device_code is None:
+            device_code = self._devices[packet.address] = len(self._devices)
+
+        self._pending.append(_encode(packet, device_code))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """버퍼에 쌓인 행을 활성 세그먼트의 컬럼 파일 끝에 기록"""
+        if not self._pending:
+            return
+        rows = np.array(
+            self._pending, dtype=[(name, dtype) for name, dtype in COLUMNS.items()]
+        )
+        for name in COLUMNS:
+            with open(os.path.join(self._segment_dir, name + ".bin"), "ab") as f:
+                f.write(np.ascontiguousarray(rows[name]).tobytes())
+        with open(os.path.join(self._segment_dir, ACTIVE_DEVICES_FILE), "w") as f:
+            json.dump(list(self._devices), f)
+        self._pending = []
+
+    def close(self):
+        """활성 세그먼트를 확정하고 저장소를 닫음"""
+        if self._segment_dir is not None:
+            self.flush()
+            _finalize_segment(self._segment_dir)
+            self._segment_start = None
+            self._segment_dir = None
+            self._devices = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _rotate(self, timestamp):
+        self.close()
+        self._segment_start = timestamp - timestamp % self.segment_seconds
+
+        # 디렉터리 이름: 첫 패킷 시각(ms). 재시작 등으로 이미 있으면 새 이름 사용
+        name = int(timestamp * 1000)
+        while os.path.exists(os.path.join(self.path, f"{name:015d}")):
+            name += 1
+        self._segment_dir = os.path.join(self.path, f"{name:015d}")
+        os.makedirs(self._segment_dir)
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        segments = self._segment_dirs()
+        for name in segments[: max(0, len(segments) - self.retention_segments)]:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def _finalize_orphans(self):
+        """비정상 종료로 확정되지 않은 세그먼트 정리"""
+        for name in self._segment_dirs():
+            segment_dir = os.path.join(self.path, name)
+            if not os.path.exists(os.path.join(segment_dir, META_FILE)):
+                _finalize_segment(segment_dir)
+
+    def _segment_dirs(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.path)
+            if name.isdigit() and os.path.isdir(os.path.join(self.path, name))
+        )
+
+    # ---------------------------------------------------------------- 조회
+
+    def query(self, address, start=None, end=None):
+        """
+        특정 디바이스의 [start, end] 구간 광고 패킷을 시간 순으로 반환합니다.
+        확정된 세그먼트는 메타데이터로 구간/디바이스를 거른 뒤, 해당 행 범위만
+        memory-map으로 읽습니다. 확정 전 세그먼트(readonly로 열었을 때 다른
+        프로세스가 쓰고 있는 활성 세그먼트 포함)는 .bin 파일을 직접 읽습니다.
+        :param address: 광고 주소
+        :param start: 시작 시각 (epoch 초, None이면 처음부터)
+        :param end: 끝 시각 (epoch 초, None이면 끝까지)
+        :return: BlePacket 리스트
+        """
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        self.flush()
+
+        packets = []
+        for name in self._segment_dirs():
+            segment_dir = os.path.join(self.path, name)
+            if segment_dir == self._segment_dir:
+                packets.extend(self._query_active(address, start, end))
+                continue
+
+            meta = _load_meta(segment_dir)
+            if meta is None:
+                # 다른 프로세스가 쓰고 있는 (또는 확정 전) 세그먼트는 .bin을 직접 읽음
+                devices = _load_devices(segment_dir)
+                try:
+                    packets.extend(_query_bins(segment_dir, devices, address, start, end))
+                    continue
+                except OSError:
+                    # 조회 중에 확정되어 .bin이 지워진 경우
+                    meta = _load_meta(segment_dir)
+                    if meta is None:
+                        continue
+            if meta["end"] < start or meta["start"] > end:
+                continue
+            rows = meta["devices"].get(address)
+            if rows is None:
+                continue
+
+            columns = {
+                column: np.load(
+                    os.path.join(segment_dir, column + ".npy"), mmap_mode="r"
+                )[rows[0] : rows[1]]
+                for column in COLUMNS
+                if column != "device"
+            }
+            lo = np.searchsorted(columns["timestamp"], start, side="left")
+            hi = np.searchsorted(columns["timestamp"], end, side="right")
+            packets.extend(_decode(address, columns, i) for i in range(lo, hi))
+
+        packets.sort(key=lambda packet: packet.timestamp)
+        return packets
+
+    def _query_active(self, address, start, end):
+        return _query_bins(
+            self._segment_dir, list(self._devices), address, start, end
+        )
+
+
+def _load_meta(segment_dir):
+    try:
+        with open(os.path.join(segment_dir, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _load_devices(segment_dir):
+    """활성 세그먼트의 디바이스 목록 (코드 순 광고 주소)"""
+    try:
+        with open(os.path.join(segment_dir, ACTIVE_DEVICES_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _query_bins(segment_dir, devices, address, start, end):
+    """확정되지 않은 세그먼트의 .bin에서 디바이스의 [start, end] 구간 패킷을 읽음"""
+    if address not in devices:
+        return []
+    columns = _load_bins(segment_dir)
+    mask = (
+        (columns["device"] == devices.index(address))
+        & (columns["timestamp"] >= start)
+        & (columns["timestamp"] <= end)
+    )
+    selected = {name: column[mask] for name, column in columns.items()}
+    return [_decode(address, selected, i) for i in range(int(mask.sum()))]
+
+
+def _load_bins(segment_dir):
+    """활성 세그먼트의 컬럼 .bin 파일을 memory-map으로 읽음"""
+    columns = {}
+    for name, dtype in COLUMNS.items():
+        path = os.path.join(segment_dir, name + ".bin")
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            columns[name] = np.memmap(path, dtype=dtype, mode="r")
+        else:
+            columns[name] = np.empty(0, dtype=dtype)
+    count = min(len(column) for column in columns.values())
+    return {name: column[:count] for name, column in columns.items()}
+
+
+def _finalize_segment(segment_dir):
+    """활성 세그먼트를 (디바이스, 시간) 순으로 정렬해 .npy와 디바이스 인덱스로 확정"""
+    devices = _load_devices(segment_dir)
+    columns = _load_bins(segment_dir)
+    count = len(columns["timestamp"])
+    if count == 0 or not devices:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        return
+
+    order = np.lexsort((columns["timestamp"], columns["device"]))
+    for name, column in columns.items():
+        np.save(os.path.join(segment_dir, name + ".npy"), np.asarray(column)[order])
+    del columns
+
+    device_column = np.load(os.path.join(segment_dir, "device.npy"))
+    timestamps = np.load(os.path.join(segment_dir, "timestamp.npy"), mmap_mode="r")
+    index = {}
+    for code, address in enumerate(devices):
+        lo = int(np.searchsorted(device_column, code, side="left"))
+        hi = int(np.searchsorted(device_column, code, side="right"))
+        if hi > lo:
+            index[address] = [lo, hi]
+
+    meta = {
+        "start": float(timestamps.min()),
+        "end": float(timestamps.max()),
+        "rows": count,
+        "devices": index,
+    }
+    with open(os.path.join(segment_dir, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+    for name in [column + ".bin" for column in COLUMNS] + [ACTIVE_DEVICES_FILE]:
+        path = os.path.join(segment_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("사용법: python store.py <저장소 경로> <광고 주소> [시작 epoch] [끝 epoch]")
+        sys.exit(1)
+
+    from tabulate import tabulate
+
+    path = sys.argv[1]
+    address = sys.argv[2]
+    start = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    end = float(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    store = CaptureStore(path, readonly=True)
+    packets = store.query(address, start, end)
+    table_data = [
+        [
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(packet.timestamp)),
+            f"{packet.timestamp:.6f}",
+            packet.channel,
+            packet.rssi,
+            packet.payload.hex(":"),
+        ]
+        for packet in packets
+    ]
+    headers = ["시각", "타임스탬프", "채널", "RSSI", "광고 데이터"]
+    print(tabulate(table_data, headers=headers, tablefmt="fancy_grid"))
+    print(f"총 {len(packets)}개 패킷")
+
+
+if __name__ == "__main__":
+    main()